@@ -1,15 +1,29 @@
+import asyncio
 import base64
 import logging
 import os
+import time
 from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 
-import boto3
-from botocore.exceptions import ClientError
-from opensearchpy import OpenSearch
-from opensearchpy import RequestsHttpConnection
-from pydantic import BaseSettings
+from app.helper import startup
 
-from app.search.service import CSSearchService
+with startup.timed("import app"):
+    from opensearchpy import AsyncOpenSearch
+    from pydantic import BaseSettings
+
+    from app.helper import logs, serializer
+    from app.helper.batcher import MicroBatcher
+    from app.helper.breaker import CircuitBreaker
+    from app.helper.cache import TTLCache
+    from app.helper.hedging import Hedger
+    from app.helper.limiter import ConcurrencyLimiter
+    from app.helper.singleflight import SingleFlight
+    from app.helper.slowlog import SlowQueryLog
+    from app.search.service import CSSearchService
+
+if TYPE_CHECKING:
+    from app.search.replica import StationReplica
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -17,12 +31,13 @@ env_name = os.getenv("ACTIVE_ENVIRONMENT")
 
 
 def get_logger(name) -> logging.Logger:
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                        datefmt='%d-%b-%y %H:%M:%S')
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    logger.addHandler(logging.StreamHandler())
-    return logger
+    """
+    Logging of the "app" logger tree is configured once per process (LOG_LEVEL, LOG_FORMAT), see helper/logs.py.
+    Ex. get_logger(name="app.search.route")
+    """
+    settings = app_settings()
+    logs.configure("app", level=settings.log_level, fmt=settings.log_format)
+    return logging.getLogger(name)
 
 
 class Settings(BaseSettings):
@@ -30,29 +45,65 @@ class Settings(BaseSettings):
     os_host: str
     os_port: int = 443
     os_user_name: str
+    os_user_password: Optional[str] = None
     os_region: str
+    os_pool_maxsize: int = 50
+    secret_refresh_seconds: float = 3600.0
+    search_cache_size: int = 4096
+    search_cache_ttl_seconds: float = 30.0
+    search_batch_max_size: int = 100
+    search_coalesce_window_ms: float = 0.0
+    search_coalesce_max_batch: int = 50
+    search_stream_chunk_size: int = 500
+    search_concurrency_limit: int = 50
+    search_concurrency_adaptive: bool = False
+    search_concurrency_min: int = 4
+    search_concurrency_max: int = 200
+    search_queue_size: int = 100
+    search_queue_timeout_ms: float = 1000.0
+    search_retry_after_seconds: int = 1
+    search_timeout_ms: float = 3000.0
+    search_shard_timeout_ms: float = 2000.0
+    search_hedge: bool = False
+    search_hedge_percentile: float = 95.0
+    search_hedge_max_ratio: float = 0.1
+    search_breaker_failures: int = 5
+    search_breaker_slow_ms: float = 2500.0
+    search_breaker_open_seconds: float = 10.0
+    search_stale_cache_size: int = 4096
+    search_stale_ttl_seconds: float = 3600.0
+    search_replica: bool = False
+    search_replica_refresh_seconds: float = 60.0
+    search_replica_updated_field: Optional[str] = None
+    search_replica_full_refresh_seconds: float = 3600.0
+    search_passthrough_response: bool = True
+    json_backend: str = "auto"
+    log_level: str = "INFO"
+    log_format: str = "json"
+    slow_query_threshold_ms: float = 500.0
+    slow_query_sample_rate: float = 1.0
+    admin_api_key: Optional[str] = None
 
     class Config:
-        print("Base directory->", BASE_DIR)
         env_file = f"{BASE_DIR}/conf/{env_name}.env"
 
 
 @lru_cache()
 def app_settings():
-    return Settings()
-
-
-settings = app_settings()  # invoke method to cache the configuration.
+    """
+    Loaded on first use, nothing is read or created while importing the app package.
+    """
+    with startup.timed("settings"):
+        settings = Settings()
+        serializer.configure(settings.json_backend)
+    return settings
 
-region = settings.os_region
-service = 'es'
-credentials = boto3.Session().get_credentials()
-# aws_auth = AWS4Auth(refreshable_credentials=credentials, region=region, service=service)
-admin_pwd: str
 
+def fetch_secret() -> str:
+    # boto3 is imported on first use, it is not needed when OS_USER_PASSWORD is set.
+    import boto3
+    from botocore.exceptions import ClientError
 
-@lru_cache()
-def get_secret() -> str:
     secret_name = "OpenSearchAdminPwd"
     region_name = "ap-south-1"
 
@@ -99,18 +150,254 @@ def get_secret() -> str:
     # Your code goes here.
 
 
-os_client = OpenSearch(
-    hosts=[settings.os_host],
-    http_auth=(settings.os_user_name, get_secret()),
-    use_ssl=True,
-    verify_certs=True,
-    ssl_assert_hostname=False,
-    ssl_show_warn=False,
-    connection_class=RequestsHttpConnection
-)
+# (secret, monotonic time it was fetched)
+_secret_entry = None
+# background refresh of the secret in progress
+_secret_refresh: Optional[asyncio.Future] = None
+
+
+def _refresh_secret():
+    global _secret_entry
+    try:
+        secret = fetch_secret()
+    except Exception as e:
+        get_logger(name="app").warning("Secret refresh failed, using the cached secret: %s", e)
+        secret = _secret_entry[0]
+    _secret_entry = (secret, time.monotonic())
+
+
+def get_secret() -> str:
+    """
+    OpenSearch admin password, OS_USER_PASSWORD when set, else from Secrets Manager.
+    The fetched secret is cached for SECRET_REFRESH_SECONDS, if a refresh fails the cached one is kept.
+    Only the first fetch blocks, on an event loop an expired secret is refreshed on an executor thread
+    and the cached one is returned meanwhile.
+    """
+    global _secret_entry, _secret_refresh
+    settings = app_settings()
+    if settings.os_user_password:
+        return settings.os_user_password
+    if _secret_entry is None:
+        with startup.timed("secret"):
+            _secret_entry = (fetch_secret(), time.monotonic())
+    elif time.monotonic() - _secret_entry[1] >= settings.secret_refresh_seconds:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _refresh_secret()
+        else:
+            if _secret_refresh is None or _secret_refresh.done():
+                _secret_refresh = loop.run_in_executor(None, _refresh_secret)
+    return _secret_entry[0]
+
+
+# (password, client) of the current async client
+_os_client_entry = None
+# in-flight requests on a rotated client get this long to finish before it is closed
+ROTATED_CLIENT_GRACE_SECONDS = 30.0
+# rotated client -> task closing it
+_rotated_clients = {}
+
+
+async def _close_rotated(client: AsyncOpenSearch):
+    await asyncio.sleep(ROTATED_CLIENT_GRACE_SECONDS)
+    del _rotated_clients[client]
+    await client.close()
+
+
+def _build_os_async_client(password: str) -> AsyncOpenSearch:
+    settings = app_settings()
+    with startup.timed("os_async_client"):
+        return AsyncOpenSearch(
+            hosts=[settings.os_host],
+            http_auth=(settings.os_user_name, password),
+            use_ssl=True,
+            verify_certs=True,
+            ssl_show_warn=False,
+            maxsize=settings.os_pool_maxsize,
+            serializer=serializer.OpenSearchSerializer()
+        )
+
+
+def get_os_async_client() -> AsyncOpenSearch:
+    """
+    Non-blocking client (aiohttp), used by the API and the Lambda handler.
+    Its connection pool is bound to the event loop of the first request.
+    Built on first use and rebuilt when the secret changes, the old client is closed after a grace period.
+    """
+    global _os_client_entry
+    password = get_secret()
+    if _os_client_entry is not None and _os_client_entry[0] == password:
+        return _os_client_entry[1]
+    old = _os_client_entry[1] if _os_client_entry is not None else None
+    _os_client_entry = (password, _build_os_async_client(password))
+    if old is not None:
+        try:
+            _rotated_clients[old] = asyncio.get_running_loop().create_task(_close_rotated(old))
+        except RuntimeError:
+            pass
+    return _os_client_entry[1]
+
+
+@lru_cache()
+def get_search_cache() -> TTLCache:
+    """
+    Search results shared by all service instances of this process, set SEARCH_CACHE_SIZE=0 to disable.
+    """
+    settings = app_settings()
+    return TTLCache(max_size=settings.search_cache_size, ttl_seconds=settings.search_cache_ttl_seconds)
+
+
+async def _coalesced_msearch(queries: list[str]) -> list[dict]:
+    return await get_os_search_service().msearch_queries(queries)
+
+
+@lru_cache()
+def get_search_batcher() -> Optional[MicroBatcher]:
+    """
+    Opt-in, SEARCH_COALESCE_WINDOW_MS > 0 merges API searches arriving within the window into one _msearch.
+    """
+    settings = app_settings()
+    if settings.search_coalesce_window_ms <= 0:
+        return None
+    return MicroBatcher(flush=_coalesced_msearch, window_ms=settings.search_coalesce_window_ms,
+                        max_size=settings.search_coalesce_max_batch)
+
+
+@lru_cache()
+def get_search_singleflight() -> SingleFlight:
+    """
+    Identical API queries in flight at the same time share one OpenSearch call.
+    """
+    return SingleFlight()
+
+
+@lru_cache()
+def get_search_slow_log() -> SlowQueryLog:
+    """
+    Searches slower than SLOW_QUERY_THRESHOLD_MS, sampled at SLOW_QUERY_SAMPLE_RATE, are logged with their query.
+    """
+    settings = app_settings()
+    return SlowQueryLog(logger=get_logger(name="app.search.slowlog"), threshold_ms=settings.slow_query_threshold_ms,
+                        sample_rate=settings.slow_query_sample_rate)
+
+
+@lru_cache()
+def get_search_limiter() -> Optional[ConcurrencyLimiter]:
+    """
+    Admission control of API searches, SEARCH_CONCURRENCY_LIMIT concurrent OpenSearch calls (0 disables)
+    and SEARCH_QUEUE_SIZE waiting ones, SEARCH_CONCURRENCY_ADAPTIVE tunes the limit from their latency.
+    """
+    settings = app_settings()
+    if settings.search_concurrency_limit <= 0:
+        return None
+    return ConcurrencyLimiter(limit=settings.search_concurrency_limit, max_queue=settings.search_queue_size,
+                              queue_timeout_ms=settings.search_queue_timeout_ms,
+                              retry_after=settings.search_retry_after_seconds,
+                              adaptive=settings.search_concurrency_adaptive,
+                              min_limit=settings.search_concurrency_min, max_limit=settings.search_concurrency_max)
+
+
+@lru_cache()
+def get_search_hedger() -> Optional[Hedger]:
+    """
+    Opt-in, SEARCH_HEDGE resends searches slower than the SEARCH_HEDGE_PERCENTILE latency to other shard copies.
+    """
+    settings = app_settings()
+    if not settings.search_hedge:
+        return None
+    return Hedger(percentile=settings.search_hedge_percentile, max_ratio=settings.search_hedge_max_ratio)
+
+
+@lru_cache()
+def get_search_breaker() -> Optional[CircuitBreaker]:
+    """
+    Opens after SEARCH_BREAKER_FAILURES consecutive OpenSearch failures or calls slower than
+    SEARCH_BREAKER_SLOW_MS, searches then fail fast for SEARCH_BREAKER_OPEN_SECONDS (0 failures disables).
+    """
+    settings = app_settings()
+    if settings.search_breaker_failures <= 0:
+        return None
+    return CircuitBreaker(failure_threshold=settings.search_breaker_failures,
+                          slow_call_ms=settings.search_breaker_slow_ms or None,
+                          open_seconds=settings.search_breaker_open_seconds, is_failure=CSSearchService.is_failure)
+
+
+@lru_cache()
+def get_search_stale_cache() -> Optional[TTLCache]:
+    """
+    Last good result per request, served marked stale while OpenSearch fails (SEARCH_STALE_CACHE_SIZE=0 disables).
+    """
+    settings = app_settings()
+    if settings.search_stale_cache_size <= 0:
+        return None
+    return TTLCache(max_size=settings.search_stale_cache_size, ttl_seconds=settings.search_stale_ttl_seconds)
+
+
+@lru_cache()
+def get_search_replica() -> Optional["StationReplica"]:
+    """
+    Opt-in, SEARCH_REPLICA keeps charging_stations in memory (needs numpy) and serves location and filter
+    searches from it, reloaded every SEARCH_REPLICA_REFRESH_SECONDS. With SEARCH_REPLICA_UPDATED_FIELD,
+    only documents updated since the last refresh are fetched, and everything every
+    SEARCH_REPLICA_FULL_REFRESH_SECONDS.
+    """
+    settings = app_settings()
+    if not settings.search_replica:
+        return None
+    # imported here, it loads numpy, which the Lambda and a disabled replica never need.
+    from app.search.replica import StationReplica
+    return StationReplica(get_client=get_os_async_client, logger=get_logger(name="app.search.replica"),
+                          refresh_seconds=settings.search_replica_refresh_seconds,
+                          updated_field=settings.search_replica_updated_field,
+                          full_refresh_seconds=settings.search_replica_full_refresh_seconds)
+
+
+def search_timeouts() -> dict:
+    """
+    SEARCH_TIMEOUT_MS deadline and SEARCH_SHARD_TIMEOUT_MS OpenSearch timeout, 0 disables either.
+    """
+    settings = app_settings()
+    return {"timeout_ms": settings.search_timeout_ms, "shard_timeout_ms": settings.search_shard_timeout_ms}
+
+
+@lru_cache(maxsize=1)
+def _build_search_service(os_client: AsyncOpenSearch) -> CSSearchService:
+    return CSSearchService(os_client=os_client, logger=get_logger(name="app.search.service"),
+                           cache=get_search_cache(), batcher=get_search_batcher(),
+                           singleflight=get_search_singleflight(), slow_log=get_search_slow_log(),
+                           limiter=get_search_limiter(), hedger=get_search_hedger(), breaker=get_search_breaker(),
+                           stale_cache=get_search_stale_cache(), replica=get_search_replica(), **search_timeouts())
 
 
 def get_os_search_service():
-    if os_client is None:
-        raise RuntimeError("OpenSearch client was not initialized.")
-    return CSSearchService(os_client=os_client, logger=get_logger(name="app.search.service"))
+    """
+    One service per process for the API, rebuilt only with its client.
+    """
+    return _build_search_service(get_os_async_client())
+
+
+@lru_cache(maxsize=1)
+def _build_lambda_search_service(os_client: AsyncOpenSearch) -> CSSearchService:
+    return CSSearchService(os_client=os_client, logger=get_logger(name="app.search.service"),
+                           cache=get_search_cache(), slow_log=get_search_slow_log(), hedger=get_search_hedger(),
+                           breaker=get_search_breaker(), stale_cache=get_search_stale_cache(), **search_timeouts())
+
+
+def get_lambda_search_service():
+    """
+    One service per Lambda execution environment, rebuilt only with its client.
+    """
+    return _build_lambda_search_service(get_os_async_client())
+
+
+async def close_os_clients():
+    """
+    Releases the pooled aiohttp connections held by the async client, if it was created, and by rotated ones.
+    """
+    for client, task in list(_rotated_clients.items()):
+        task.cancel()
+        del _rotated_clients[client]
+        await client.close()
+    if _os_client_entry is not None:
+        await _os_client_entry[1].close()
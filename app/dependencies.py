@@ -3,6 +3,7 @@ from app import get_logger
 
 def inject_logger(name):
     """
-    Logger object, can be injected directly to router methods.
+    Logger object by name. For router methods inject a parameterless callable (see search.route.RouteLogger),
+    FastAPI would otherwise expect name as a query parameter.
     """
     return get_logger(name=name)
@@ -5,3 +5,18 @@ class SearchException(Exception):
         self.message = message
         self.detail_error = detail_error
 
+
+class SearchRejectedException(SearchException):
+    """
+    Search shed by admission control, retry_after (seconds) is sent as the Retry-After header.
+    """
+
+    def __init__(self, code, message, detail_error=None, retry_after=1):
+        super().__init__(code, message, detail_error)
+        self.retry_after = retry_after
+
+
+class CircuitOpenException(SearchRejectedException):
+    """
+    Search failed fast because the circuit breaker in front of OpenSearch is open.
+    """
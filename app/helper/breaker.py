@@ -0,0 +1,98 @@
+import math
+import time
+from typing import Any, Awaitable, Callable
+
+from app.exception.customexception import CircuitOpenException
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency: after failure_threshold consecutive failures (errors for which
+    is_failure is true, or calls slower than slow_call_ms) the circuit opens and calls fail fast with
+    CircuitOpenException for open_seconds. Then one probe call is let through (half open), its success
+    closes the circuit, its failure opens it again.
+    Ex. await breaker.run(lambda: os_client.search(body=query))
+    """
+
+    def __init__(self, failure_threshold: int = 5, slow_call_ms: float = None, open_seconds: float = 10.0,
+                 is_failure: Callable[[Exception], bool] = None):
+        self.failure_threshold = failure_threshold
+        self.slow_call_ms = slow_call_ms
+        self.open_seconds = open_seconds
+        self.is_failure = is_failure or (lambda e: True)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self.opened = 0
+        self.short_circuited = 0
+
+    def _allow(self) -> tuple:
+        """
+        Returns (allowed, probe).
+        """
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True, False
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True, True
+        return False, False
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.open_seconds - (time.monotonic() - self.opened_at)))
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        allowed, probe = self._allow()
+        if not allowed:
+            self.short_circuited += 1
+            raise CircuitOpenException(code=503, message="Search is temporarily unavailable, retry later.",
+                                       retry_after=self.retry_after())
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except Exception as e:
+            self._record(not self.is_failure(e), probe)
+            raise
+        except BaseException:
+            # cancelled (deadline), only a call that was already slow is a failure.
+            if self._slow(started):
+                self._record(False, probe)
+            elif probe:
+                self._probing = False
+            raise
+        self._record(not self._slow(started), probe)
+        return result
+
+    def _slow(self, started: float) -> bool:
+        return bool(self.slow_call_ms) and (time.perf_counter() - started) * 1000 >= self.slow_call_ms
+
+    def _record(self, success: bool, probe: bool):
+        if probe:
+            self._probing = False
+        if success:
+            # calls started before the circuit opened do not close it, only the probe does.
+            if self.state != OPEN:
+                self.state = CLOSED
+                self.failures = 0
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.opened += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited
+        }
@@ -1,4 +1,9 @@
 import json
+import math
+import re
+from json.encoder import encode_basestring_ascii
+
+from app.helper import serializer
 
 
 def null_check(value):
@@ -162,11 +167,23 @@ class Filter:
         self.geo_shape = None
         self.geo_distance = None
         self.term = None
+        self.range = None
+        self.geo_bounding_box = None
+        self.geo_polygon = None
+        self.bool = None
 
     def add_term(self, field: str, value: str):
         self.term = {field: value}
         return self
 
+    def add_range(self, field: str, **bounds):
+        """
+        Adds range query to filter query, bounds are gt, gte, lt, lte.
+        Ex. "range": {"updated_at": {"gte": "2022-10-18T10:00:00"}}
+        """
+        self.range = {field: bounds}
+        return self
+
     def add_geo_shape(self, field: str, shape: Shape):
         """
         Adds geo_shape query to filter query.
@@ -202,6 +219,34 @@ class Filter:
         self.geo_distance = {"distance_type": distance_type, "distance": distance, field: coordinates}
         return self
 
+    def add_geo_bounding_box(self, field: str, top_left: list[float], bottom_right: list[float]):
+        """
+        Adds geo_bounding_box query to filter query, points inside the box match.
+        Ex. "geo_bounding_box": {
+          "point": {"top_left": [12.95, 77.80], "bottom_right": [13.05, 77.70]}
+        }
+        """
+        self.geo_bounding_box = {field: {"top_left": top_left, "bottom_right": bottom_right}}
+        return self
+
+    def add_geo_polygon(self, field: str, points: list[list[float]]):
+        """
+        Adds geo_polygon query to filter query, points inside the polygon match.
+        Ex. "geo_polygon": {
+          "point": {"points": [[77.76, 12.97], [77.77, 12.97], [77.77, 12.98]]}
+        }
+        """
+        self.geo_polygon = {field: {"points": points}}
+        return self
+
+    def add_should(self, clauses: list[dict]):
+        """
+        Matches documents matching at least one of the clauses (filter clauses as dictionaries).
+        Ex. "bool": {"should": [{"geo_polygon": {...}}, {"geo_polygon": {...}}]}
+        """
+        self.bool = {"should": clauses}
+        return self
+
     def to_dict(self) -> dict:
         """
         Returns object as dictionary (key, value pairs) and ignores the keys with None.
@@ -387,13 +432,21 @@ class Query:
 class QueryBuilder:
     """
     Query Builder Helper class, to generate OpenSearch queries dynamically.
-    It also supports pagination through from and size parameters.
+    It supports pagination through from and size parameters, or through sort and search_after (cursor).
     """
 
     def __init__(self, frm=None, size=None):
         self.offset = frm
         self.limit = size
         self.query = None
+        self.sort = None
+        self.search_after = None
+        self.pit = None
+        self._source = None
+        self.profile = None
+        self.timeout = None
+        self.aggs = None
+        self.track_total_hits = None
 
     def add_query(self, query_root: Query):
         """
@@ -403,12 +456,138 @@ class QueryBuilder:
         self.query = query_root.to_dict()
         return self
 
+    def add_sort(self, field: str, order: str = "asc", **options):
+        """
+        Appends sort clause, sort values of the last hit can be passed to add_search_after for the next page.
+        Ex. "sort": [{"_geo_distance": {"geo_address": [12.97, 77.76], "order": "asc", "unit": "km"}},
+                     {"station_id.keyword": {"order": "asc"}}]
+        """
+        if self.sort is None:
+            self.sort = []
+        self.sort.append({field: {**options, "order": order}})
+        return self
+
+    def add_search_after(self, values: list):
+        """
+        Starts the page after the hit with given sort values.
+        Ex. "search_after": [0.532, "115"]
+        """
+        self.search_after = values
+        return self
+
+    def add_pit(self, pit_id: str, keep_alive: str = "1m"):
+        """
+        Searches a point in time instead of the live index, so a sequence of pages sees the same data.
+        Ex. "pit": {"id": "46ToAwMDaWR4...", "keep_alive": "1m"}
+        """
+        self.pit = {"id": pit_id, "keep_alive": keep_alive}
+        return self
+
+    def add_source(self, includes: list[str] = None, excludes: list[str] = None):
+        """
+        Restricts the returned _source to the included fields (wildcards allowed) minus the excluded ones.
+        Ex. "_source": {"includes": ["name", "geo_address"], "excludes": ["available_chargers"]}
+        """
+        self._source = {key: value for key, value in (("includes", includes), ("excludes", excludes)) if value}
+        return self
+
+    def add_profile(self):
+        """
+        Asks OpenSearch for per shard timing of each query and collector (profile API), for debugging only.
+        Ex. "profile": true
+        """
+        self.profile = True
+        return self
+
+    def add_timeout(self, timeout: str):
+        """
+        Shard level time limit, shards still running return what they found so far and the response is timed_out.
+        Ex. "timeout": "1500ms"
+        """
+        self.timeout = timeout
+        return self
+
+    def add_track_total_hits(self):
+        """
+        Counts all matching documents, by default hits.total stops at 10000.
+        Ex. "track_total_hits": true
+        """
+        self.track_total_hits = True
+        return self
+
+    def add_aggregation(self, name: str, agg_type: str, aggregations: dict = None, **params):
+        """
+        Adds a named aggregation, with optional sub aggregations, results are in the response under the name.
+        Ex. "aggs": {"clusters": {"geohash_grid": {"field": "geo_address", "precision": 5},
+                                  "aggs": {"centroid": {"geo_centroid": {"field": "geo_address"}}}}}
+        """
+        if self.aggs is None:
+            self.aggs = {}
+        self.aggs[name] = {agg_type: params}
+        if aggregations:
+            self.aggs[name]["aggs"] = aggregations
+        return self
+
     def build(self) -> str:
         """
-        Builds the final query and returns as string.
+        Builds the final query and returns as string, keys with None are ignored.
         """
         mapping = {'offset': 'from', 'limit': 'size'}
-        return json.dumps({mapping.get(k, k): v for k, v in self.__dict__.items()})
+        return serializer.dumps({mapping.get(k, k): v for k, v in self.__dict__.items() if v is not None})
+
+
+def json_value(value) -> str:
+    """
+    Same output as serializer.dumps(value), with shortcuts for the scalar types used in query parameters
+    (integers for every backend, the others when the standard library backend is active).
+    """
+    value_type = type(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if serializer.backend != "json":
+        return serializer.dumps(value)
+    if value_type is str:
+        return encode_basestring_ascii(value)
+    if value_type is float and math.isfinite(value):
+        return float.__repr__(value)
+    if value_type is list:
+        return "[" + ", ".join([json_value(item) for item in value]) + "]"
+    return json.dumps(value)
+
+
+class QueryTemplate:
+    """
+    Query string compiled once, with named placeholders to be filled per request.
+    A placeholder is any JSON string value starting with "__tpl_<name>__", rendering replaces the whole
+    JSON string with the JSON encoded value of <name>, so fragments never need to be re-serialized.
+    Ex. QueryTemplate('{"from": "__tpl_offset__", "size": 10}').render({"offset": 20})
+        -> '{"from": 20, "size": 10}'
+    """
+    __token__ = re.compile(r'"__tpl_(\w+?)__[^"]*"')
+
+    def __init__(self, query: str):
+        self.fragments = []
+        self.params = []
+        position = 0
+        for token in self.__token__.finditer(query):
+            self.fragments.append(query[position:token.start()])
+            self.params.append(token.group(1))
+            position = token.end()
+        self.fragments.append(query[position:])
+
+    @staticmethod
+    def placeholder(name: str) -> str:
+        return "__tpl_{}__".format(name)
+
+    def render(self, values: dict) -> str:
+        """
+        Fills the placeholders with values and returns the final query string.
+        """
+        parts = [self.fragments[0]]
+        for name, fragment in zip(self.params, self.fragments[1:]):
+            parts.append(json_value(values[name]))
+            parts.append(fragment)
+        return "".join(parts)
 
 # if __name__ == "__main__":
 #     query = QueryBuilder(frm=0, size=100) \
@@ -0,0 +1,52 @@
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Approximate cell width (km) at the equator for each geohash precision, index = precision.
+CELL_WIDTH_KM = [40075.0, 5009.4, 1252.3, 156.5, 39.1, 4.89, 1.22, 0.153, 0.0382, 0.00477, 0.0012, 0.000149,
+                 0.0000372]
+
+
+def encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    """
+    Encodes latitude/longitude into a geohash string of given precision.
+    Ex. encode(12.978958, 77.769305, 7) -> "tdr1y5z"
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+
+def precision_for_km(cell_km: float) -> int:
+    """
+    Returns the coarsest geohash precision whose cell width is not larger than cell_km.
+    """
+    for precision, width in enumerate(CELL_WIDTH_KM):
+        if precision > 0 and width <= cell_km:
+            return precision
+    return len(CELL_WIDTH_KM) - 1
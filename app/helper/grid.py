@@ -0,0 +1,90 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from app.helper.spatial import EARTH_RADIUS_KM, KM_PER_DEGREE
+
+
+def haversine_km(latitude: float, longitude: float, latitudes, longitudes):
+    """
+    Arc distances (km) from one point to arrays of points, all in degrees, vectorized over the arrays.
+    """
+    lat = math.radians(latitude)
+    lats = np.radians(latitudes)
+    half_dlat = (lats - lat) / 2
+    half_dlon = (np.radians(longitudes) - math.radians(longitude)) / 2
+    a = np.sin(half_dlat) ** 2 + math.cos(lat) * np.cos(lats) * np.sin(half_dlon) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """
+    Immutable array backed grid over points: points are sorted by cell (cell_deg x cell_deg degrees), a radius
+    query reads one contiguous slice per cell row of its bounding box, then filters the candidates by distance.
+    Positions returned are indexes into the latitudes/longitudes given at construction.
+    Ex. GridIndex(lats, lons).within(12.97, 77.76, 2.0) -> (positions, distances_km), nearest first
+    """
+
+    def __init__(self, latitudes, longitudes, cell_deg: float = 0.1):
+        if np is None:
+            raise ImportError("numpy is required for the spatial index.")
+        self.cell_deg = cell_deg
+        self.columns = int(math.ceil(360 / cell_deg)) + 1
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        cells = self._cells(latitudes, longitudes)
+        self.order = np.argsort(cells, kind="stable")
+        self.cells = cells[self.order]
+        self.latitudes = latitudes[self.order]
+        self.longitudes = longitudes[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def _row(self, latitude):
+        return np.floor((np.asarray(latitude) + 90) / self.cell_deg).astype(np.int64)
+
+    def _column(self, longitude):
+        return np.floor((np.asarray(longitude) + 180) / self.cell_deg).astype(np.int64)
+
+    def _cells(self, latitudes, longitudes):
+        return self._row(latitudes) * self.columns + self._column(longitudes)
+
+    def _candidates(self, latitude: float, longitude: float, radius_km: float):
+        """
+        Sorted array slots of the cells overlapping the bounding box of the circle, None to scan everything
+        (the box crosses a pole or the antimeridian).
+        """
+        dlat = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(latitude))
+        if latitude - dlat <= -90 or latitude + dlat >= 90 or cos_lat <= 1e-6:
+            return None
+        dlon = dlat / cos_lat
+        if longitude - dlon < -180 or longitude + dlon >= 180:
+            return None
+        first_row, last_row = int(self._row(latitude - dlat)), int(self._row(latitude + dlat))
+        first_column, last_column = int(self._column(longitude - dlon)), int(self._column(longitude + dlon))
+        rows = np.arange(first_row, last_row + 1, dtype=np.int64) * self.columns
+        starts = np.searchsorted(self.cells, rows + first_column, side="left")
+        ends = np.searchsorted(self.cells, rows + last_column, side="right")
+        return np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]) \
+            if len(rows) else np.empty(0, dtype=np.int64)
+
+    def within(self, latitude: float, longitude: float, radius_km: float, subset=None) -> tuple:
+        """
+        Positions of the points within radius_km and their distances, sorted by distance.
+        subset: optional array of positions to restrict the result to (already filtered points).
+        """
+        slots = self._candidates(latitude, longitude, radius_km)
+        if slots is None:
+            slots = np.arange(len(self.order))
+        if subset is not None:
+            slots = slots[np.isin(self.order[slots], subset)]
+        distances = haversine_km(latitude, longitude, self.latitudes[slots], self.longitudes[slots])
+        inside = distances <= radius_km
+        slots, distances = slots[inside], distances[inside]
+        nearest = np.argsort(distances, kind="stable")
+        return self.order[slots[nearest]], distances[nearest]
@@ -0,0 +1,70 @@
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+
+class Hedger:
+    """
+    Hedged requests: when a call has not returned after the percentile latency of recent calls, a second copy
+    is sent with a different preference (so OpenSearch is likely to pick other shard copies) and the first
+    result wins, the other call is cancelled.
+    Hedges are capped at max_ratio of calls, so a slow cluster does not get twice the load.
+    Ex. await hedger.run(lambda preference: os_client.search(body=query, preference=preference))
+    """
+
+    def __init__(self, percentile: float = 95.0, window: int = 200, default_delay_ms: float = 50.0,
+                 min_delay_ms: float = 5.0, max_ratio: float = 0.1):
+        self.percentile = percentile
+        self.default_delay_ms = default_delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.max_ratio = max_ratio
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> float:
+        """
+        Seconds to wait before hedging, default_delay_ms until a tenth of the window has been observed.
+        """
+        if len(self._latencies) < max(1, self._latencies.maxlen // 10):
+            return self.default_delay_ms / 1000
+        ordered = sorted(self._latencies)
+        rank = min(len(ordered) - 1, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+        return max(self.min_delay_ms / 1000, ordered[rank])
+
+    async def run(self, call: Callable[[Optional[str]], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        started = time.perf_counter()
+        primary = asyncio.ensure_future(call(None))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.delay())
+            if not done and self.hedged < self.max_ratio * self.calls:
+                self.hedged += 1
+                pending.add(asyncio.ensure_future(call("hedge-" + uuid.uuid4().hex[:8])))
+            while True:
+                if not done:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                successful = [task for task in done if task.exception() is None]
+                if successful or not pending:
+                    winner = successful[0] if successful else done.pop()
+                    if winner is not primary:
+                        self.hedge_wins += 1
+                    self._latencies.append(time.perf_counter() - started)
+                    return winner.result()
+                done = set()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "delay_ms": round(self.delay() * 1000, 2),
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins
+        }
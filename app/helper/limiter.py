@@ -0,0 +1,120 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from app.exception.customexception import SearchRejectedException
+
+# Weight of a new latency sample in the long term average, about the last 100 calls.
+LONG_RTT_WEIGHT = 0.01
+# Weight of a new limit estimate in the adaptive limit.
+LIMIT_SMOOTHING = 0.2
+# Latency up to tolerance x the long term average does not shrink the limit.
+RTT_TOLERANCE = 1.5
+
+
+class ConcurrencyLimiter:
+    """
+    Admission control: at most limit calls run at once, up to max_queue more wait in FIFO order for a slot.
+    A full queue rejects at once with 429, a wait longer than queue_timeout_ms with 503, both carry retry_after.
+    adaptive: the limit follows observed call latency (gradient): it shrinks while latency rises above its
+    long term average and grows by about sqrt(limit) while latency holds, within [min_limit, max_limit].
+    Ex. await limiter.run(lambda: os_client.search(body=query))
+    """
+
+    def __init__(self, limit: int = 50, max_queue: int = 100, queue_timeout_ms: float = 1000.0,
+                 retry_after: int = 1, adaptive: bool = False, min_limit: int = 4, max_limit: int = 200):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout_ms = queue_timeout_ms
+        self.retry_after = retry_after
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self._estimate = float(limit)
+        self._long_rtt = None
+        self._waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        await self._acquire()
+        started = time.perf_counter()
+        try:
+            return await fn()
+        finally:
+            self._release(time.perf_counter() - started)
+
+    async def _acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise SearchRejectedException(code=429, message="Too many searches in progress, retry later.",
+                                          retry_after=self.retry_after)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        timer = loop.call_later(self.queue_timeout_ms / 1000, self._expire, future)
+        try:
+            await future
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise SearchRejectedException(code=503, message="Search is overloaded, retry later.",
+                                          retry_after=self.retry_after)
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # the slot was handed over just before the caller was cancelled.
+                self._release()
+            elif future in self._waiters:
+                self._waiters.remove(future)
+            raise
+        finally:
+            timer.cancel()
+        self.admitted += 1
+
+    def _expire(self, future: asyncio.Future):
+        if not future.done():
+            self._waiters.remove(future)
+            future.set_exception(asyncio.TimeoutError())
+
+    def _release(self, latency: float = None):
+        self.in_flight -= 1
+        if self.adaptive and latency is not None:
+            self._adapt(latency)
+        # slots are handed to waiters in order, a freed slot never goes to a newcomer first.
+        while self._waiters and self.in_flight < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _adapt(self, latency: float):
+        self._long_rtt = latency if self._long_rtt is None \
+            else self._long_rtt * (1 - LONG_RTT_WEIGHT) + latency * LONG_RTT_WEIGHT
+        # far below the limit, latency says nothing about the capacity left.
+        if self.in_flight + 1 < self.limit / 2:
+            return
+        gradient = max(0.5, min(1.0, RTT_TOLERANCE * self._long_rtt / latency)) if latency > 0 else 1.0
+        estimate = self._estimate * gradient + math.sqrt(self._estimate)
+        self._estimate = self._estimate * (1 - LIMIT_SMOOTHING) + estimate * LIMIT_SMOOTHING
+        self._estimate = max(self.min_limit, min(self.max_limit, self._estimate))
+        self.limit = int(self._estimate)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
@@ -0,0 +1,72 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.helper import serializer
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has, anything else on a record was passed through extra=.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))) | {"message", "asctime"}
+
+_queue: Optional[queue.Queue] = None
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, extra= fields are added as top level keys.
+    Ex. {"time": "2022-10-18T16:12:06", "level": "INFO", "logger": "app.search.route", "message": "Search took 17"}
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return serializer.dumps(entry, default=str)
+
+
+def configure(logger_name: str = "app", level: str = "INFO", fmt: str = "json") -> logging.Logger:
+    """
+    Configures logger_name (and its children) once per process: callers only enqueue records,
+    a background thread formats and writes them to stdout, so request handlers never wait on I/O.
+    fmt: json (structured) or text.
+    """
+    global _queue, _listener
+    logger = logging.getLogger(logger_name)
+    if _listener is not None:
+        return logger
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT,
+                                                                                 datefmt='%d-%b-%y %H:%M:%S'))
+    _queue = queue.Queue(-1)
+    _listener = QueueListener(_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop)
+    logger.addHandler(QueueHandler(_queue))
+    logger.setLevel(level)
+    # records are written once, by this handler, not again by handlers of the root logger.
+    logger.propagate = False
+    return logger
+
+
+def flush():
+    """
+    Waits until queued records are written, for the end of a Lambda invocation before the environment is frozen.
+    """
+    if _listener is not None and _listener._thread is not None:
+        _queue.join()
+
+
+def stop():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
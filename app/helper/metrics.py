@@ -0,0 +1,190 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Upper bounds in seconds, from sub millisecond query building to multi second OpenSearch calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Metrics in registration order, rendered by render().
+REGISTRY = []
+
+
+def _labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series = {}
+        REGISTRY.append(self)
+
+    def value(self, *label_values):
+        return self._series.get(label_values)
+
+    def lines(self) -> list[str]:
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.type)]
+        for label_values, value in self._series.items():
+            lines.append("{}{} {}".format(self.name, _labels(self.labels, label_values), _number(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonic count. Ex. ERRORS.inc("500")
+    """
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down. Ex. with IN_FLIGHT.track(): ...
+    """
+    type = "gauge"
+
+    def inc(self, *label_values, amount: float = 1):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    @contextmanager
+    def track(self, *label_values):
+        self.inc(*label_values)
+        try:
+            yield
+        finally:
+            self.dec(*label_values)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets (cumulative in the output, as Prometheus expects).
+    Ex. STAGE_SECONDS.observe(0.012, "opensearch")
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # per bucket counts (last one is +Inf), sum, count
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def lines(self) -> list[str]:
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.type)]
+        for label_values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="{}"'.format("+Inf" if bound == float("inf") else bound)
+                lines.append("{}_bucket{} {}".format(self.name, _labels(self.labels, label_values, le), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, _labels(self.labels, label_values), _number(total)))
+            lines.append("{}_count{} {}".format(self.name, _labels(self.labels, label_values), count))
+        return lines
+
+
+STAGE_SECONDS = Histogram("search_stage_seconds",
+                          "Search latency by stage: validate, build_query, opensearch (round trip), "
+                          "opensearch_took, network, reshape, serialize.", labels=("stage",))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency.", labels=("path",))
+REQUESTS = Counter("http_requests_total", "HTTP requests by status code.", labels=("path", "status"))
+ERRORS = Counter("search_errors_total", "HTTP responses with an error status, unhandled exceptions count as 500.",
+                 labels=("path", "status"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served.")
+OS_IN_FLIGHT = Gauge("opensearch_requests_in_flight", "OpenSearch calls awaiting a response.")
+OS_ERRORS = Counter("opensearch_errors_total", "Failed OpenSearch calls.")
+
+
+class RequestTimings:
+    """
+    Stage durations of one request (API call or Lambda invocation), for the Server-Timing header.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """
+        Ex. "build_query;dur=0.04, opensearch;dur=12.31, total;dur=13.02", durations in milliseconds.
+        """
+        entries = ["{};dur={:.2f}".format(stage, seconds * 1000) for stage, seconds in self.stages.items()]
+        entries.append("total;dur={:.2f}".format((time.perf_counter() - self.started) * 1000))
+        return ", ".join(entries)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def request_timings():
+    """
+    Collects the stages recorded while serving one request.
+    Tasks started inside (the route handler under BaseHTTPMiddleware) share the same RequestTimings.
+    """
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def record(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+def record_elapsed(stage: str):
+    """
+    Records the time since the current request started.
+    Ex. record_elapsed("validate") first thing in a route handler: routing, body parsing and validation.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        record(stage, time.perf_counter() - timings.started)
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    return "\n".join(line for metric in REGISTRY for line in metric.lines()) + "\n"
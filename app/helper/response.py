@@ -0,0 +1,13 @@
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+from app.helper import metrics, serializer
+
+
+class JSONResponse(StarletteJSONResponse):
+    """
+    FastAPI response class rendering content with the active serializer backend.
+    """
+
+    def render(self, content) -> bytes:
+        with metrics.timed("serialize"):
+            return serializer.dumps_bytes(content)
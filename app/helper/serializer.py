@@ -0,0 +1,76 @@
+import json
+
+from opensearchpy import JSONSerializer
+from opensearchpy.exceptions import SerializationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("auto", "orjson", "json")
+
+# Active backend, set by configure(). "json" is the standard library.
+backend = "json"
+
+
+def configure(name: str = "auto") -> str:
+    """
+    Selects the JSON backend used by the whole app and returns the active one.
+    auto: orjson when it is installed, else the standard library.
+    """
+    global backend
+    if name not in BACKENDS:
+        raise ValueError("Unknown JSON backend {}, expected one of {}".format(name, BACKENDS))
+    if name == "orjson" and orjson is None:
+        raise ImportError("JSON backend orjson is not installed.")
+    backend = "orjson" if name == "auto" and orjson is not None else ("json" if name == "auto" else name)
+    return backend
+
+
+def dumps(obj, default=None) -> str:
+    """
+    Serializes obj to a JSON string (query bodies, Lambda responses, NDJSON lines).
+    The standard library keeps its default formatting, so query strings stay the same as with json.dumps.
+    """
+    if backend == "orjson":
+        return orjson.dumps(obj, default=default).decode()
+    return json.dumps(obj, default=default)
+
+
+def dumps_bytes(obj, default=None) -> bytes:
+    """
+    Serializes obj to compact UTF-8 JSON bytes, for HTTP responses.
+    """
+    if backend == "orjson":
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, default=default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def loads(data):
+    if backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class OpenSearchSerializer(JSONSerializer):
+    """
+    opensearch-py transport serializer backed by the active backend, for request bodies and responses.
+    Ex. OpenSearch(hosts=[...], serializer=OpenSearchSerializer())
+    """
+
+    def loads(self, s):
+        try:
+            return loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # don't serialize strings, query bodies are built as strings already.
+        if isinstance(data, str):
+            return data
+        try:
+            return dumps(data, default=self.default)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
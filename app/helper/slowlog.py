@@ -0,0 +1,43 @@
+import logging
+import random
+
+from app.helper import serializer
+
+
+class SlowQueryLog:
+    """
+    Logs searches slower than threshold_ms as one JSON record (query, took, hits, filter shape),
+    a sample_rate below 1 logs only that fraction of them.
+    Ex. {"elapsed_ms": 812.4, "took": 790, "hits": 12, "shape": ["text", "location"], "query": "{...}"}
+    """
+
+    def __init__(self, logger: logging.Logger, threshold_ms: float = 500.0, sample_rate: float = 1.0):
+        self.logger = logger
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.slow = 0
+        self.logged = 0
+
+    def observe(self, elapsed_ms: float, took: float, hits: int, shape: tuple, query: str) -> bool:
+        if elapsed_ms < self.threshold_ms:
+            return False
+        self.slow += 1
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        self.logged += 1
+        self.logger.warning("Slow query: %s", serializer.dumps({
+            "elapsed_ms": round(elapsed_ms, 2),
+            "took": took,
+            "hits": hits,
+            "shape": list(shape),
+            "query": query
+        }))
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "sample_rate": self.sample_rate,
+            "slow": self.slow,
+            "logged": self.logged
+        }
@@ -0,0 +1,132 @@
+import math
+from typing import Optional
+
+# Mean earth radius used by OpenSearch arc distances.
+EARTH_RADIUS_KM = 6371.0087714
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def geo_point(value) -> Optional[tuple]:
+    """
+    (latitude, longitude) of a geo_point value read the way OpenSearch reads it:
+    arrays are [lon, lat], strings "lat,lon", objects {"lat": .., "lon": ..}.
+    """
+    try:
+        if isinstance(value, (list, tuple)) and len(value) >= 2:
+            return float(value[1]), float(value[0])
+        if isinstance(value, dict):
+            return float(value["lat"]), float(value["lon"])
+        if isinstance(value, str) and "," in value:
+            lat, lon = value.split(",")[:2]
+            return float(lat), float(lon)
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+
+def distance_km(a: tuple, b: tuple) -> float:
+    """
+    Arc distance between two (latitude, longitude) points.
+    """
+    lat_a, lat_b = math.radians(a[0]), math.radians(b[0])
+    h = math.sin((lat_b - lat_a) / 2) ** 2 + \
+        math.cos(lat_a) * math.cos(lat_b) * math.sin(math.radians(b[1] - a[1]) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(h, 1.0)))
+
+
+def _segment_offset(point: tuple, a: tuple, b: tuple) -> tuple:
+    """
+    (offset_km, t) of point to segment a-b, t in [0, 1] is the closest position on the segment.
+    Flat projection around point, accurate for segments up to a few hundred km.
+    """
+    kx = KM_PER_DEGREE * math.cos(math.radians(point[0]))
+    ax, ay = (a[1] - point[1]) * kx, (a[0] - point[0]) * KM_PER_DEGREE
+    dx, dy = (b[1] - a[1]) * kx, (b[0] - a[0]) * KM_PER_DEGREE
+    length2 = dx * dx + dy * dy
+    t = min(max(-(ax * dx + ay * dy) / length2, 0.0), 1.0) if length2 > 0 else 0.0
+    return math.hypot(ax + t * dx, ay + t * dy), t
+
+
+def simplify(points: list[tuple], tolerance_km: float) -> list[tuple]:
+    """
+    Douglas-Peucker: drops points closer than tolerance_km to the simplified line, ends are kept.
+    """
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, offset = None, tolerance_km
+        for i in range(first + 1, last):
+            point_offset = _segment_offset(points[i], points[first], points[last])[0]
+            if point_offset > offset:
+                farthest, offset = i, point_offset
+        if farthest is not None:
+            keep[farthest] = True
+            stack.extend(((first, farthest), (farthest, last)))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def segment_box(a: tuple, b: tuple, half_width_km: float) -> list[tuple]:
+    """
+    Corners of the rectangle around segment a-b, half_width_km on each side and past each end,
+    so the boxes of consecutive segments overlap at their joint.
+    """
+    latitude = (a[0] + b[0]) / 2
+    kx = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    dx, dy = (b[1] - a[1]) * kx, (b[0] - a[0]) * KM_PER_DEGREE
+    length = math.hypot(dx, dy)
+    ux, uy = (dx / length, dy / length) if length > 0 else (1.0, 0.0)
+    w = half_width_km
+    corners = []
+    for (x, y), along in (((0.0, 0.0), -w), ((dx, dy), w)):
+        for side in ((-w, w) if along < 0 else (w, -w)):
+            cx, cy = x + ux * along - uy * side, y + uy * along + ux * side
+            corners.append((a[0] + cy / KM_PER_DEGREE, a[1] + cx / kx))
+    return corners
+
+
+def corridor_boxes(points: list[tuple], buffer_km: float, max_boxes: int) -> list[list[tuple]]:
+    """
+    At most max_boxes rectangles covering every point within buffer_km of the polyline: the line is simplified
+    (tolerance doubled until it has few enough segments) and the boxes widened by the tolerance.
+    """
+    tolerance = buffer_km / 4
+    line = simplify(points, tolerance)
+    while len(line) - 1 > max_boxes:
+        tolerance *= 2
+        line = simplify(points, tolerance)
+    return [segment_box(a, b, buffer_km + tolerance) for a, b in zip(line, line[1:])] if len(line) > 1 \
+        else [segment_box(line[0], line[0], buffer_km)]
+
+
+class Route:
+    """
+    Polyline of (latitude, longitude) points, with positions along it.
+    Ex. Route([(12.97, 77.59), (13.0, 77.7)]).position((12.98, 77.65)) -> (along_km, offset_km)
+    """
+
+    def __init__(self, points: list[tuple]):
+        self.points = points
+        self.starts = [0.0]
+        for a, b in zip(points, points[1:]):
+            self.starts.append(self.starts[-1] + distance_km(a, b))
+
+    @property
+    def length_km(self) -> float:
+        return self.starts[-1]
+
+    def position(self, point: tuple) -> tuple:
+        """
+        (along_km, offset_km): distance along the route to the closest route point, and the distance to it.
+        """
+        if len(self.points) == 1:
+            return 0.0, distance_km(self.points[0], point)
+        best = None
+        for i, (a, b) in enumerate(zip(self.points, self.points[1:])):
+            offset, t = _segment_offset(point, a, b)
+            if best is None or offset < best[1]:
+                best = (self.starts[i] + t * (self.starts[i + 1] - self.starts[i]), offset)
+        return best
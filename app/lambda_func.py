@@ -1,15 +1,35 @@
 import asyncio
-import json
 
-from pydantic import ValidationError
+from app.helper import startup
 
-from app import get_os_search_service
-from app.dependencies import inject_logger
-from app.exception.customexception import SearchException
-from app.search.schema import CSSearchRequest
+with startup.timed("import app.lambda_func"):
+    from pydantic import ValidationError
+
+    from app import app_settings, get_lambda_search_service
+    from app.dependencies import inject_logger
+    from app.exception.customexception import SearchException
+    from app.helper import logs, metrics, serializer
+    from app.search.schema import CSSearchRequest
 
 logger = inject_logger(name="app.lambda_func")
 
+# True until the first invocation of this execution environment has been served.
+cold_start = True
+
+# One event loop for the life of the execution environment, the async client's connection pool is bound to it.
+_loop = None
+
+
+def run(coro):
+    """
+    Runs coro on the execution environment's event loop, unlike asyncio.run the loop is kept between invocations.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
+
 
 class LambdaError:
 
@@ -38,10 +58,28 @@ def handler(event, context):
                 "avg_rating": null
             }
         }
+    Batch event: a list of such requests, {"requests": [...]} or an SQS style {"Records": [{"body": "<request>"}]},
+    runs as one multi-search and returns a list with one result or error per request, in order.
+    Warm-up event: {"warmup": true, "connections": 2}, opens pooled connections to OpenSearch without searching.
     """
     logger.info("Lambda Request ID: %s", context.aws_request_id)
     logger.info("Event data: %s", str(event))
-    return process_request(event)
+    global cold_start
+    with metrics.request_timings() as timings:
+        items = batch_items(event)
+        if items is not None:
+            response = process_batch(items)
+        elif isinstance(event, dict) and event.get("warmup"):
+            response = warm_up(event.get("connections", 1))
+        else:
+            response = process_request(event)
+    logger.info("Timings: %s", timings.server_timing())
+    if cold_start:
+        cold_start = False
+        logger.info("Cold start timings: %s", startup.report())
+    # the environment may be frozen once the handler returns, queued records are written first.
+    logs.flush()
+    return response
 
 
 def validate_input(cs_request):
@@ -55,23 +93,98 @@ def validate_input(cs_request):
             raise SearchException(code=400, message="Invalid longitude.")
 
 
+def batch_items(event):
+    """
+    Returns the request items of a batch event, None for a single request event (or any other value,
+    process_request answers it with an error).
+    """
+    if isinstance(event, list):
+        return event
+    if not isinstance(event, dict):
+        return None
+    if isinstance(event.get("requests"), list):
+        return event["requests"]
+    if isinstance(event.get("Records"), list):
+        return [record.get("body") for record in event["Records"]]
+    return None
+
+
+def parse_request(item) -> CSSearchRequest:
+    with metrics.timed("validate"):
+        if isinstance(item, (str, bytes)):
+            item = serializer.loads(item)
+        cs_request = CSSearchRequest(**item)
+        validate_input(cs_request)
+    return cs_request
+
+
+def process_batch(items):
+    results = [None] * len(items)
+    positions = []
+    cs_requests = []
+    for i, item in enumerate(items):
+        try:
+            cs_requests.append(parse_request(item))
+            positions.append(i)
+        except ValidationError as ve:
+            results[i] = LambdaError(code=400, message="Invalid Input", detail_error=ve.json()).__dict__
+        except SearchException as se:
+            results[i] = LambdaError(code=se.code, message=se.message, detail_error=se.detail_error).__dict__
+        except (ValueError, TypeError) as e:
+            results[i] = LambdaError(code=400, message="Invalid Input", detail_error=str(e)).__dict__
+
+    # Bounded multi-search bodies, same limit as the API batch endpoint.
+    chunk_size = app_settings().search_batch_max_size
+    for start in range(0, len(cs_requests), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        try:
+            batch = run(get_lambda_search_service().msearch(cs_requests[start:start + chunk_size]))
+            for i, item in zip(chunk, batch):
+                if item.error is not None:
+                    results[i] = LambdaError(code=item.error.code, message=item.error.message,
+                                             detail_error=item.error.detail_error).__dict__
+                else:
+                    results[i] = item.result
+        except SearchException as se:
+            logger.error(se)
+            for i in chunk:
+                results[i] = LambdaError(code=se.code, message=se.message, detail_error=se.detail_error).__dict__
+        except Exception as e:
+            logger.error(e)
+            for i in chunk:
+                results[i] = LambdaError(code=500, message="Internal Server Error", detail_error=str(e)).__dict__
+    logger.info("Batch size: %d", len(items))
+    with metrics.timed("serialize"):
+        return serializer.dumps(results, default=lambda o: o.__dict__)
+
+
+def warm_up(connections: int = 1):
+    try:
+        opened = run(get_lambda_search_service().warm_up(connections))
+        logger.info("Warm-up opened %d of %d connections.", opened, connections)
+        return serializer.dumps({"warmup": True, "connections": opened})
+    except Exception as e:
+        logger.error(e)
+        return serializer.dumps(LambdaError(code=500, message="Internal Server Error", detail_error=str(e)).__dict__)
+
+
 def process_request(event):
     try:
-        cs_request = CSSearchRequest(**event)
-        validate_input(cs_request)
-        cs_result = asyncio.run(get_os_search_service().search(cs_request))
+        cs_request = parse_request(event)
+        cs_result = run(get_lambda_search_service().search(cs_request))
         logger.info("Result size: %d", cs_result.total)
         logger.info("OpenSearch took: %d", cs_result.took)
-        return json.dumps(cs_result, default=lambda o: o.__dict__)
+        with metrics.timed("serialize"):
+            return serializer.dumps(cs_result, default=lambda o: o.__dict__)
     except ValidationError as ve:
         logger.error(ve)
-        return json.dumps(LambdaError(code=400, message="Invalid Input", detail_error=ve.json()).__dict__)
+        return serializer.dumps(LambdaError(code=400, message="Invalid Input", detail_error=ve.json()).__dict__)
     except SearchException as se:
         logger.error(se)
-        return json.dumps(LambdaError(code=se.code, message=se.message, detail_error=se.detail_error).__dict__)
+        return serializer.dumps(LambdaError(code=se.code, message=se.message, detail_error=se.detail_error).__dict__)
     except Exception as e:
         logger.error(e)
-        return json.dumps(LambdaError(code=500, message="Internal Server Error", detail_error=str(e)).__dict__)
+        return serializer.dumps(LambdaError(code=500, message="Internal Server Error", detail_error=str(e)).__dict__)
 
 # if __name__ == "__main__":
 #     ctx = {"aws_request_id": "12"}
@@ -1,11 +1,18 @@
 import time
 
-import uvicorn
-from fastapi import FastAPI, Request
-from starlette.middleware.cors import CORSMiddleware
+from app.helper import startup
 
-from app import app_settings, get_logger
-from app.search.route import router as search_router
+with startup.timed("import app.main"):
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import PlainTextResponse
+
+    from app import app_settings, close_os_clients, get_logger, get_search_replica
+    from app.exception.customexception import SearchException, SearchRejectedException
+    from app.helper import metrics
+    from app.helper.response import JSONResponse
+    from app.search.route import router as search_router
 
 settings = app_settings()
 
@@ -15,6 +22,7 @@ logger = get_logger(name="app.main")
 
 app = FastAPI(
     title=settings.app_name,
+    default_response_class=JSONResponse,
 )
 
 app.add_middleware(
@@ -26,27 +34,71 @@ app.add_middleware(
 )
 
 
+def route_path(request: Request) -> str:
+    # the matched route, unmatched paths share one label so clients cannot grow the series.
+    return request.url.path if request.scope.get("endpoint") is not None else "unmatched"
+
+
 @app.middleware("http")
 async def authenticate(request: Request, call_nxt):
-    req_start_time = time.time()
-    response = await call_nxt(request)
-    req_elapsed_time = time.time() - req_start_time
+    with metrics.request_timings() as timings, metrics.IN_FLIGHT.track():
+        try:
+            response = await call_nxt(request)
+        except Exception:
+            metrics.REQUESTS.inc(route_path(request), "500")
+            metrics.ERRORS.inc(route_path(request), "500")
+            raise
+        req_elapsed_time = time.perf_counter() - timings.started
+    path = route_path(request)
+    metrics.REQUEST_SECONDS.observe(req_elapsed_time, path)
+    metrics.REQUESTS.inc(path, str(response.status_code))
+    if response.status_code >= 400:
+        metrics.ERRORS.inc(path, str(response.status_code))
     response.headers["x-elapsed-time"] = str(req_elapsed_time)
+    response.headers["server-timing"] = timings.server_timing()
     return response
 
 
+@app.exception_handler(SearchException)
+async def search_exception_handler(request: Request, se: SearchException):
+    """
+    SearchException status code and message as the response, shed searches tell clients when to retry.
+    """
+    if isinstance(se, SearchRejectedException):
+        return JSONResponse(status_code=se.code, content={"message": se.message},
+                            headers={"Retry-After": str(se.retry_after)})
+    if se.code >= 500:
+        logger.error("%s: %s", se.message, se.detail_error)
+    return JSONResponse(status_code=se.code, content={"message": se.message})
+
+
 # Registering API Routers.
 app.include_router(search_router)
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint, latency histograms per search stage, in-flight gauges and error counters.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.on_event("startup")
-def on_start():
-    logger.info("Starting API.")
+async def on_start():
+    logger.info("Starting API, startup timings: %s", startup.report())
+    replica = get_search_replica()
+    if replica is not None:
+        replica.start()
 
 
 @app.on_event("shutdown")
-def on_shutdown():
+async def on_shutdown():
     logger.info("Shutting down.")
+    replica = get_search_replica()
+    if replica is not None:
+        await replica.stop()
+    await close_os_clients()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,291 @@
+import asyncio
+import inspect
+import logging
+import re
+import time
+from typing import Any, Callable, Optional
+
+from app.helper import metrics
+from app.helper.esqueryhelper import QueryBuilder, Query, Bool, Must, Filter
+from app.helper.grid import GridIndex, np
+from app.helper.spatial import geo_point
+from app.search.schema import CSSearchRequest
+from app.search.service import TERM_FILTERS, CURSOR_TIEBREAK_FIELD, MAX_RESULT_WINDOW, CSSearchService, \
+    source_fields, term_value
+
+# Approximates the standard analyzer tokens of text fields, term filters match one token.
+TOKEN = re.compile(r"\w+(?:[.']\w+)*")
+
+
+def field_values(doc: dict, path: str) -> list:
+    """
+    Leaf values of a dotted field path, arrays of objects are flattened like OpenSearch object fields.
+    Ex. field_values(doc, "total_charger_data.connectors.status") -> ["available", "charging"]
+    """
+    values = [doc]
+    for part in path.split("."):
+        values = [item[part] for value in values for item in (value if isinstance(value, list) else [value])
+                  if isinstance(item, dict) and item.get(part) is not None]
+    return [item for value in values for item in (value if isinstance(value, list) else [value])]
+
+
+def index_terms(value) -> set:
+    if isinstance(value, bool):
+        return {str(value).lower()}
+    if isinstance(value, (int, float)):
+        return {float(value)}
+    if isinstance(value, str):
+        return set(TOKEN.findall(value.lower()))
+    return set()
+
+
+def query_terms(value) -> set:
+    """
+    Index terms a term filter value can match: the value itself, as a number if it is one, as text if it is one.
+    """
+    value = term_value(value)
+    terms = {value}
+    if isinstance(value, str):
+        try:
+            terms.add(float(value))
+        except ValueError:
+            pass
+    elif isinstance(value, (int, float)):
+        terms.update({float(value), str(value)})
+    return terms
+
+
+def project(source: dict, includes: Optional[list[str]]) -> dict:
+    """
+    _source filtering for plain (dotted) field names, same output as OpenSearch includes without wildcards.
+    """
+    if includes is None:
+        return source
+    projected = {}
+    for path in includes:
+        parts = path.split(".")
+        value = source
+        for part in parts:
+            value = value.get(part) if isinstance(value, dict) else None
+        if value is None:
+            continue
+        target = projected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return projected
+
+
+class Snapshot:
+    """
+    Immutable replica content, replaced as a whole on refresh so searches never see a partial update.
+    """
+
+    def __init__(self, docs: dict):
+        self.ids = []
+        self.sources = []
+        latitudes = []
+        longitudes = []
+        postings = {field: {} for field, _ in TERM_FILTERS}
+        for doc_id, source in docs.items():
+            point = geo_point(source.get("geo_address"))
+            position = len(self.ids)
+            self.ids.append(doc_id)
+            self.sources.append(source)
+            # documents without a point never match a distance filter, they are kept for term filters.
+            latitudes.append(point[0] if point else np.nan)
+            longitudes.append(point[1] if point else np.nan)
+            for field, _ in TERM_FILTERS:
+                for term in set().union(*(index_terms(value) for value in field_values(source, field))):
+                    postings[field].setdefault(term, []).append(position)
+        self.postings = {field: {term: np.asarray(positions, dtype=np.int64) for term, positions in terms.items()}
+                         for field, terms in postings.items()}
+        located = ~np.isnan(np.asarray(latitudes, dtype=np.float64))
+        self.located = np.flatnonzero(located)
+        self.grid = GridIndex(np.asarray(latitudes)[located], np.asarray(longitudes)[located])
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class StationReplica:
+    """
+    In-process read replica of the charging_stations index for location and term filter searches.
+    It is loaded in the background at startup and refreshed every refresh_seconds: with updated_field, only
+    documents updated since the last refresh are fetched (deletions are picked up by the full reload every
+    full_refresh_seconds), otherwise the whole index is reloaded.
+    Searches with text, cursor, pit, profile, viewport, route, aggregations or wildcard fields go to
+    OpenSearch, as do all searches until the first load completes. get_client returns the OpenSearch client,
+    called per load so a rotated secret is picked up. Hits are sorted by distance, scores are 0 as for
+    OpenSearch filter queries.
+    """
+
+    def __init__(self, get_client: Callable[[], Any], logger: logging.Logger,
+                 index: str = CSSearchService.__index_name__, page_size: int = 5000,
+                 refresh_seconds: float = 60.0, updated_field: str = None, full_refresh_seconds: float = 3600.0):
+        if np is None:
+            raise ImportError("numpy is required for the station replica.")
+        self.get_client = get_client
+        self.logger = logger
+        self.index = index
+        self.page_size = page_size
+        self.refresh_seconds = refresh_seconds
+        self.updated_field = updated_field
+        self.full_refresh_seconds = full_refresh_seconds
+        self.snapshot: Optional[Snapshot] = None
+        self._docs = {}
+        self._updated_since = None
+        self._loaded_at = None
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.refreshes = 0
+        self.served = 0
+
+    async def _fetch(self, filter_query: Filter = None) -> list[tuple]:
+        """
+        (id, _source) of all matching documents, read in station_id order with search_after.
+        """
+        docs = []
+        search_after = None
+        while True:
+            bool_query = Bool().add_must(Must().add_match_all()).add_filter(filter_query)
+            qb = QueryBuilder(size=self.page_size).add_query(Query().add_bool(bool_query)) \
+                .add_sort(CURSOR_TIEBREAK_FIELD)
+            if search_after is not None:
+                qb.add_search_after(search_after)
+            response = self.get_client().search(body=qb.build(), index=self.index)
+            if inspect.isawaitable(response):
+                response = await response
+            hits = response["hits"]["hits"]
+            docs.extend((hit["_id"], hit["_source"]) for hit in hits)
+            if len(hits) < self.page_size:
+                return docs
+            search_after = hits[-1]["sort"]
+
+    def _latest_update(self, docs) -> Optional[str]:
+        values = [value for _, source in docs for value in field_values(source, self.updated_field)]
+        return max(values) if values else self._updated_since
+
+    async def load(self):
+        started = time.perf_counter()
+        docs = dict(await self._fetch())
+        if self.updated_field:
+            self._updated_since = self._latest_update(docs.items())
+        await self._swap(docs)
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        self.logger.info("Replica loaded %d stations in %.0f ms.", len(docs), (time.perf_counter() - started) * 1000)
+
+    async def refresh(self):
+        if not self.updated_field or self._updated_since is None \
+                or time.monotonic() - self._loaded_at >= self.full_refresh_seconds:
+            return await self.load()
+        changed = await self._fetch(Filter().add_range(self.updated_field, gte=self._updated_since))
+        self.refreshes += 1
+        if changed:
+            self._updated_since = self._latest_update(changed)
+            await self._swap({**self._docs, **dict(changed)})
+
+    async def _swap(self, docs: dict):
+        # building the arrays takes a while for 10^5 stations, it runs off the event loop.
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, Snapshot, docs)
+        self._docs = docs
+        self.snapshot = snapshot
+
+    async def run(self):
+        """
+        Keeps the replica loaded and fresh until cancelled, failures are logged and retried on the next cycle.
+        """
+        while True:
+            try:
+                await (self.refresh() if self.snapshot is not None else self.load())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning("Replica refresh failed: %s", e)
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def can_answer(self, request: CSSearchRequest) -> bool:
+        if self.snapshot is None or request.cursor or request.pit or request.profile or request.viewport \
+                or request.route or request.aggregations:
+            return False
+        search_by = request.search_by
+        if search_by is None or search_by.text:
+            return False
+        has_terms = any(getattr(search_by, attr) for _, attr in TERM_FILTERS)
+        if request.location is None and (request.nearest or not has_terms):
+            return False
+        if request.location is not None and (request.proximity_in_km is None or geo_point(request.location) is None):
+            return False
+        if request.offset + request.limit > MAX_RESULT_WINDOW:
+            return False
+        includes = source_fields(request)
+        return includes is None or not any("*" in field for field in includes)
+
+    def search(self, request: CSSearchRequest) -> dict:
+        """
+        Same result dict as service.reshape_response, for a request can_answer accepted.
+        """
+        started = time.perf_counter()
+        with metrics.timed("replica"):
+            snapshot = self.snapshot
+            subset = None
+            for field, attr in TERM_FILTERS:
+                value = getattr(request.search_by, attr)
+                if not value:
+                    continue
+                postings = [snapshot.postings[field][term] for term in query_terms(value)
+                            if term in snapshot.postings[field]]
+                matched = np.unique(np.concatenate(postings)) if postings else np.empty(0, dtype=np.int64)
+                subset = matched if subset is None else np.intersect1d(subset, matched, assume_unique=True)
+            if request.location is not None:
+                latitude, longitude = geo_point(request.location)
+                within = subset if subset is None else np.flatnonzero(np.isin(snapshot.located, subset))
+                positions, distances = snapshot.grid.within(latitude, longitude, request.proximity_in_km, within)
+                positions = snapshot.located[positions]
+            else:
+                positions, distances = subset, None
+            includes = source_fields(request)
+            start, end = (0, request.nearest) if request.nearest else (request.offset, request.offset + request.limit)
+            records = [{"id": snapshot.ids[position], "score": 0.0,
+                        "charge_station": project(snapshot.sources[position], includes)}
+                       for position in positions[start:end]]
+            if request.nearest:
+                for record, distance in zip(records, distances[start:end]):
+                    record["distance_km"] = float(distance)
+        self.served += 1
+        return {
+            "took": round((time.perf_counter() - started) * 1000, 3),
+            "total": min(len(positions), MAX_RESULT_WINDOW),
+            "max_score": 0.0,
+            "records": records,
+            "next_cursor": None,
+            "profile": None,
+            "timed_out": False,
+            "partial": False,
+            "stale": False,
+            "clusters": None,
+            "aggregations": None
+        }
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.snapshot is not None,
+            "stations": len(self.snapshot) if self.snapshot is not None else 0,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "served": self.served
+        }
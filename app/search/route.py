@@ -1,11 +1,20 @@
+import hmac
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import conlist
 
-from app import get_os_search_service
+from app import get_os_search_service, get_search_cache, get_search_batcher, get_search_singleflight, \
+    get_search_slow_log, get_search_limiter, get_search_hedger, get_search_breaker, get_search_stale_cache, \
+    get_search_replica, app_settings
 from app.dependencies import inject_logger
-from app.search.schema import CSSearchResult, CSSearchRequest, Message
-from app.search.service import CSSearchService
+from app.exception.customexception import SearchException
+from app.helper import metrics, serializer
+from app.helper.response import JSONResponse
+from app.search.schema import CSSearchResult, CSSearchRequest, Message, CSBatchResult
+from app.search.service import CSSearchService, cluster_precision
 
 
 def on_startup():
@@ -13,40 +22,144 @@ def on_startup():
 
 
 def pre_shutdown():
-    print("Search Router started")
+    print("Search Router stopped")
 
 
 router = APIRouter(
     prefix="/search",
-    on_startup=on_startup(),
-    on_shutdown=pre_shutdown()
+    on_startup=[on_startup],
+    on_shutdown=[pre_shutdown]
 )
 
 
 class RouteLogger:
+    """
+    Logger dependency without parameters, a name argument would be read by FastAPI from the query string.
+    """
+
+    def __init__(self, name: str = "app.search.route"):
+        self.name = name
 
-    def __call__(self, name: str = "app.search.route"):
-        return inject_logger(name)
+    def __call__(self) -> logging.Logger:
+        return inject_logger(self.name)
 
 
 route_logger = RouteLogger()
 
 
+def authorize_profile(cs_searches: list[CSSearchRequest], admin_key: Optional[str]):
+    """
+    profile is admin only, it needs the X-Admin-Key header to match ADMIN_API_KEY (disabled when unset).
+    """
+    if not any(cs_search.profile for cs_search in cs_searches):
+        return
+    expected = app_settings().admin_api_key
+    if not expected or admin_key is None or not hmac.compare_digest(admin_key, expected):
+        raise HTTPException(status_code=403, detail="profile requires an admin key.")
+
+
+def search_response(cs_result):
+    """
+    Passthrough results are plain dicts already in the CSSearchResult shape, they are returned as they are
+    instead of being validated and encoded again through response_model.
+    """
+    if isinstance(cs_result, dict):
+        return JSONResponse(content=cs_result)
+    return cs_result
+
+
 @router.get("/", response_model=CSSearchResult, responses={404: {"model": Message}})
 async def get_stations(lat: float, long: float,
                        cs_service: CSSearchService = Depends(get_os_search_service),
                        logger: logging.Logger = Depends(route_logger)) \
         -> CSSearchResult:
-    es_results = await cs_service.search(CSSearchRequest(location=[lat, long]))
-    logger.info("Search took %d", es_results.took)
-    return es_results
+    metrics.record_elapsed("validate")
+    es_results = await cs_service.search(CSSearchRequest(location=[lat, long]),
+                                         passthrough=app_settings().search_passthrough_response)
+    logger.info("Search took %d", es_results["took"] if isinstance(es_results, dict) else es_results.took)
+    return search_response(es_results)
 
 
 @router.post("/", response_model=CSSearchResult,
              responses={404: {"model": Message}})
 async def search_stations(cs_search: CSSearchRequest,
                           cs_service: CSSearchService = Depends(get_os_search_service),
-                          logger: logging.Logger = Depends(inject_logger)) \
+                          logger: logging.Logger = Depends(route_logger),
+                          x_admin_key: Optional[str] = Header(default=None)) \
         -> CSSearchResult:
+    metrics.record_elapsed("validate")
+    authorize_profile([cs_search], x_admin_key)
     logger.info("Request for location %s", cs_search.location)
-    return await cs_service.search(cs_search)
+    return search_response(await cs_service.search(cs_search,
+                                                   passthrough=app_settings().search_passthrough_response))
+
+
+@router.post("/batch", response_model=list[CSBatchResult])
+async def batch_search_stations(cs_searches: conlist(CSSearchRequest, min_items=1,
+                                                     max_items=app_settings().search_batch_max_size),
+                                cs_service: CSSearchService = Depends(get_os_search_service),
+                                logger: logging.Logger = Depends(route_logger),
+                                x_admin_key: Optional[str] = Header(default=None)) \
+        -> list[CSBatchResult]:
+    metrics.record_elapsed("validate")
+    authorize_profile(cs_searches, x_admin_key)
+    logger.info("Batch request of %d searches", len(cs_searches))
+    return await cs_service.msearch(cs_searches)
+
+
+@router.post("/stream", response_class=StreamingResponse, responses={200: {"content": {"application/x-ndjson": {}}}})
+async def stream_stations(cs_search: CSSearchRequest,
+                          cs_service: CSSearchService = Depends(get_os_search_service),
+                          logger: logging.Logger = Depends(route_logger)) \
+        -> StreamingResponse:
+    """
+    Streams up to limit matching documents as NDJSON (one CSDocs object per line), offset is ignored.
+    An error after the first line is written as a final {"error": {...}} line.
+    profile, nearest, route and clustered viewports are not supported.
+    """
+    if cs_search.profile:
+        raise HTTPException(status_code=400, detail="profile is not supported for streams.")
+    if cs_search.nearest or cs_search.route or cluster_precision(cs_search) is not None:
+        raise HTTPException(status_code=400, detail="nearest, route and clustered viewports are not supported "
+                                                    "for streams.")
+    chunks = cs_service.stream(cs_search, chunk_size=app_settings().search_stream_chunk_size)
+    # the first chunk is fetched before responding, so early errors still get their status code.
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = []
+
+    async def ndjson():
+        chunk = first
+        try:
+            while True:
+                yield "".join(serializer.dumps(doc) + "\n" for doc in chunk)
+                chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            pass
+        except SearchException as se:
+            logger.error("Stream failed: %s", se.detail_error)
+            yield serializer.dumps({"error": {"code": se.code, "message": se.message}}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.get("/stats")
+async def search_stats() -> dict:
+    search_batcher = get_search_batcher()
+    search_limiter = get_search_limiter()
+    search_hedger = get_search_hedger()
+    search_breaker = get_search_breaker()
+    stale_cache = get_search_stale_cache()
+    replica = get_search_replica()
+    return {
+        "cache": get_search_cache().stats(),
+        "batcher": search_batcher.stats() if search_batcher is not None else None,
+        "singleflight": get_search_singleflight().stats(),
+        "slow_queries": get_search_slow_log().stats(),
+        "limiter": search_limiter.stats() if search_limiter is not None else None,
+        "hedger": search_hedger.stats() if search_hedger is not None else None,
+        "breaker": search_breaker.stats() if search_breaker is not None else None,
+        "stale_cache": stale_cache.stats() if stale_cache is not None else None,
+        "replica": replica.stats() if replica is not None else None
+    }
@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel
@@ -25,6 +26,46 @@ class SearchBy(BaseModel):
     avg_rating: Optional[float]
 
 
+class SearchView(str, Enum):
+    """
+    Named set of charge_station fields to return.
+    pin: fields needed to draw a map pin, full: the whole document.
+    """
+    pin = "pin"
+    full = "full"
+
+
+class Facet(str, Enum):
+    """
+    Fields the filter counts (terms aggregations) can be requested for, named as in SearchBy.
+    """
+    charger_point_type = "charger_point_type"
+    connector_status = "connector_status"
+    power_capacity = "power_capacity"
+    city = "city"
+
+
+class Viewport(BaseModel):
+    """
+    Visible map area, corners in the same coordinate order as location.
+    zoom: map zoom level (0 = whole world), at zoom <= 12 matching stations are returned as clusters.
+    Ex. {"top_left": [12.95, 77.80], "bottom_right": [13.05, 77.70], "zoom": 11}
+    """
+    top_left: list[float]
+    bottom_right: list[float]
+    zoom: Optional[int]
+
+
+class RouteCorridor(BaseModel):
+    """
+    Trip route as a polyline, points in the same coordinate order as location.
+    buffer_km: stations up to this distance from the route match.
+    Ex. {"points": [[12.97, 77.59], [13.01, 77.65], [13.2, 77.71]], "buffer_km": 2}
+    """
+    points: list[list[float]]
+    buffer_km: float = 2.0
+
+
 class CSSearchRequest(BaseModel):
     """
    Charge Station search request object.
@@ -42,14 +83,43 @@ class CSSearchRequest(BaseModel):
             "power_capacity": null,
             "connector_status": null,
             "avg_rating": null
-        }
+        },
+        "cursor": "*",
+        "pit": false,
+        "view": "pin",
+        "fields": null,
+        "profile": false,
+        "nearest": null,
+        "viewport": null,
+        "route": null,
+        "aggregations": ["charger_point_type", "city"]
     }
+   cursor: set "*" for the first page, then next_cursor of the previous result. Pages are sorted by distance
+   (by score without location) and station_id, offset is ignored.
+   pit: with cursor, pages are read from one point in time of the index (OpenSearch 2.4+).
+   view / fields: return only these charge_station fields, fields takes precedence over view.
+   profile: admin only, returns the OpenSearch profile of the query in the result, never served from cache.
+   nearest: k, returns the k closest stations to location sorted by distance, offset and limit are ignored.
+   The search starts at proximity_in_km and the radius grows until k stations are found.
+   viewport: only stations inside the map area, as geohash clusters (counts, no records) at low zoom.
+   route: only stations along the route, ordered by their position on it, records carry route_km.
+   aggregations: station counts per value of these fields among the matches, with limit 0 only counts
+   are returned.
    """
     offset: int = 0
     limit: int = 100
     location: Optional[list[float]]
     proximity_in_km: Optional[int] = 2
     search_by: Optional[SearchBy] = SearchBy()
+    cursor: Optional[str]
+    pit: bool = False
+    view: Optional[SearchView]
+    fields: Optional[list[str]]
+    profile: bool = False
+    nearest: Optional[int]
+    viewport: Optional[Viewport]
+    route: Optional[RouteCorridor]
+    aggregations: Optional[list[Facet]]
 
 
 # cs = CSSearchRequest(location=[2.3, 4.5], search_by=SearchBy(pincode=560067))
@@ -65,9 +135,33 @@ class CSSearchRequest(BaseModel):
 
 
 class CSDocs(BaseModel):
+    """
+    distance_km: distance from the request location, set when records are sorted by distance (nearest, cursor),
+    or from the route for route searches.
+    route_km: route searches, distance along the route to the point closest to the station.
+    """
     id: str
     score: float
     charge_station: dict
+    distance_km: Optional[float]
+    route_km: Optional[float]
+
+
+class CSCluster(BaseModel):
+    """
+    Stations of one geohash cell, location is their centroid in the same coordinate order as location.
+    """
+    geohash: str
+    count: int
+    location: list[float]
+
+
+class CSBucket(BaseModel):
+    """
+    Number of matching stations with this value of the field.
+    """
+    value: str
+    count: int
 
 
 class CSSearchResult(BaseModel):
@@ -75,8 +169,39 @@ class CSSearchResult(BaseModel):
     Documents matched to filter condition.
     Total time to filter the data, and total number of records returned by query.
     Max score assigned by Opensearch engine (this will help us to optimize our indexing.).
+    next_cursor is set for cursor requests while the page is full, pass it as cursor to fetch the next page.
+    profile is the OpenSearch profile API output of a profile request.
+    timed_out / partial: some shards hit the search timeout (or failed), records may be incomplete.
+    partial is also set for a route with more stations than are fetched, records then stop early on the route.
+    stale: OpenSearch is unavailable, this is the last good result of the same request.
+    clusters: set for a low zoom viewport search instead of records, total is then the number of stations.
+    aggregations: buckets per requested facet, most frequent values first.
     """
     took: float
     total: int
     max_score: float
     records: Optional[list[CSDocs]]
+    next_cursor: Optional[str]
+    profile: Optional[dict]
+    timed_out: bool = False
+    partial: bool = False
+    stale: bool = False
+    clusters: Optional[list[CSCluster]]
+    aggregations: Optional[dict[str, list[CSBucket]]]
+
+
+class CSSearchError(BaseModel):
+    """
+    Error details of a failed search, same fields as SearchException.
+    """
+    code: int
+    message: str
+    detail_error: Optional[str]
+
+
+class CSBatchResult(BaseModel):
+    """
+    One item of a batch search response, either result or error is set.
+    """
+    result: Optional[CSSearchResult]
+    error: Optional[CSSearchError]
@@ -1,15 +1,86 @@
+import asyncio
+import base64
+import inspect
 import logging
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Optional, Union
 
-from opensearchpy import OpenSearch
+from opensearchpy import AsyncOpenSearch, OpenSearch
+from opensearchpy.exceptions import ConnectionTimeout, TransportError
 
-from app.exception.customexception import SearchException
-from app.helper.esqueryhelper import QueryBuilder, Query, Bool, Must, Filter
-from app.search.schema import CSSearchRequest, CSSearchResult, CSDocs
+from app.exception.customexception import SearchException, SearchRejectedException, CircuitOpenException
+from app.helper import geohash, metrics, serializer, spatial
+from app.helper.batcher import MicroBatcher
+from app.helper.breaker import CircuitBreaker
+from app.helper.cache import TTLCache
+from app.helper.hedging import Hedger
+from app.helper.limiter import ConcurrencyLimiter
+from app.helper.esqueryhelper import QueryBuilder, Query, Bool, Must, Filter, QueryTemplate
+from app.helper.singleflight import SingleFlight
+from app.helper.slowlog import SlowQueryLog
+from app.search.schema import CSSearchRequest, CSSearchResult, SearchBy, CSBatchResult, CSSearchError, \
+    SearchView, Viewport, Facet, RouteCorridor
+
+if TYPE_CHECKING:
+    from app.search.replica import StationReplica
+
+
+CURSOR_START = "*"
+# Unique per station, keeps the cursor sort order total.
+CURSOR_TIEBREAK_FIELD = "station_id.keyword"
+PIT_KEEP_ALIVE = "1m"
+# OpenSearch index.max_result_window, from + size may not exceed it.
+MAX_RESULT_WINDOW = 10000
+# nearest searches multiply the radius by NEAREST_GROWTH until k stations are found or NEAREST_MAX_KM is reached.
+NEAREST_GROWTH = 4
+NEAREST_MAX_KM = 512
+# viewports at this zoom or below return geohash clusters, at most CLUSTER_MAX_BUCKETS of them.
+CLUSTER_MAX_ZOOM = 12
+CLUSTER_MAX_BUCKETS = 1000
+# a route is searched as at most CORRIDOR_MAX_BOXES polygons, the CORRIDOR_MAX_HITS stations nearest to its start
+# are ordered.
+CORRIDOR_MAX_BOXES = 32
+CORRIDOR_MAX_HITS = 1000
+
+# keyword field counted for each Facet, and the number of values returned per facet.
+FACET_FIELDS = {
+    Facet.charger_point_type: "total_charger_data.charger_point_type.keyword",
+    Facet.connector_status: "total_charger_data.connectors.status.keyword",
+    Facet.power_capacity: "total_charger_data.power_capacity.keyword",
+    Facet.city: "town.keyword"
+}
+FACET_SIZE = 20
+
+# charge_station fields returned for each SearchView, None returns the whole document.
+SOURCE_VIEWS = {
+    SearchView.pin: ["station_id", "name", "geo_address", "total_connectors_available"],
+    SearchView.full: None
+}
+
+# (index field, SearchBy attribute) pairs for term filters, in the order they are added to the query.
+TERM_FILTERS = (("name", "name"),
+                ("address_line", "area"),
+                ("country", "country"),
+                ("state", "state"),
+                ("town", "city"),
+                ("rating.avg_rating", "avg_rating"),
+                ("total_charger_data.charger_point_type", "charger_point_type"),
+                ("postal_code", "pincode"),
+                ("total_charger_data.power_capacity", "power_capacity"),
+                ("total_charger_data.connectors.status", "connector_status"))
+
+
+def term_value(value):
+    """
+    Term filter value as it is queried and keyed in the cache. Ex. " Pune" -> "pune"
+    """
+    return value.strip().lower() if isinstance(value, str) else value
 
 
 def add_filter_clause(field, value):
     if value:
-        return Filter().add_term(field=field, value=value.lower())
+        return Filter().add_term(field=field, value=term_value(value))
     else:
         return None
 
@@ -37,75 +108,805 @@ def add_geo_clause(request):
         return None
 
 
-def build_query(request: CSSearchRequest) -> str:
+def add_viewport_clause(request):
+    if request.viewport is not None:
+        return Filter().add_geo_bounding_box(field="geo_address", top_left=request.viewport.top_left,
+                                             bottom_right=request.viewport.bottom_right)
+    else:
+        return None
+
+
+def add_corridor_clause(corridor):
+    if corridor is not None:
+        return Filter().add_should(corridor)
+    else:
+        return None
+
+
+def route_points(request: CSSearchRequest) -> list[tuple]:
+    return [spatial.geo_point(point) for point in request.route.points]
+
+
+def corridor_clauses(request: CSSearchRequest) -> list[dict]:
     """
-    Method to build dynamic OS Query with the requested filters.
+    geo_polygon filters covering the route buffer, see spatial.corridor_boxes.
+    """
+    boxes = spatial.corridor_boxes(route_points(request), request.route.buffer_km, CORRIDOR_MAX_BOXES)
+    return [Filter().add_geo_polygon("geo_address", [[lon, lat] for lat, lon in box]).to_dict() for box in boxes]
+
+
+def order_along_route(cs_result: dict, request: CSSearchRequest) -> dict:
+    """
+    Keeps the stations within buffer_km of the route (the polygons cover a little more), ordered by
+    their position along it, then applies offset and limit. Positions are measured on the route
+    simplified to a tenth of the buffer.
+    Hits come nearest to the route start first (distance_km). When more stations matched than were fetched,
+    only the start of the route up to the farthest hit less buffer_km is complete: later stations are
+    dropped and the result is partial.
+    """
+    buffer_km = request.route.buffer_km
+    route = spatial.Route(spatial.simplify(route_points(request), buffer_km / 10))
+    fetched = cs_result["records"]
+    truncated = cs_result["total"] > len(fetched)
+    # a station at route_km is at most route_km + buffer_km from the start, so it was fetched if that is less
+    reach = fetched[-1]["distance_km"] - buffer_km if truncated and fetched else None
+    placed = []
+    for record in fetched:
+        point = spatial.geo_point(record["charge_station"].get("geo_address"))
+        if point is None:
+            continue
+        route_km, distance = route.position(point)
+        if distance <= buffer_km and (reach is None or route_km < reach):
+            placed.append((route_km, distance, record))
+    placed.sort(key=lambda item: item[0])
+    records = [{**record, "route_km": route_km, "distance_km": distance}
+               for route_km, distance, record in placed[request.offset:request.offset + request.limit]]
+    total = cs_result["total"] if truncated else len(placed)
+    return {**cs_result, "records": records, "total": total, "partial": cs_result["partial"] or truncated}
+
+
+def add_cluster_aggregation(qb: QueryBuilder, precision):
+    """
+    Stations per geohash cell of the given precision, with the centroid of each cell for its marker.
+    """
+    return qb.add_aggregation("clusters", "geohash_grid",
+                              aggregations={"centroid": {"geo_centroid": {"field": "geo_address"}}},
+                              field="geo_address", precision=precision, size=CLUSTER_MAX_BUCKETS)
+
+
+def add_facet_aggregations(qb: QueryBuilder, facets):
+    """
+    One terms aggregation per facet, named after it. total is counted in full, facet only (limit 0) requests
+    report it as the number of matching stations.
+    """
+    for facet in facets:
+        qb.add_aggregation(facet.value, "terms", field=FACET_FIELDS[facet], size=FACET_SIZE)
+    if facets:
+        qb.add_track_total_hits()
+    return qb
+
+
+def facets(request: CSSearchRequest) -> list[Facet]:
+    return list(dict.fromkeys(request.aggregations)) if request.aggregations else []
+
+
+def add_distance_sort(qb: QueryBuilder, request: CSSearchRequest):
+    """
+    Nearest first, the sort value of each hit is its distance in km.
+    """
+    return qb.add_sort("_geo_distance", geo_address=request.location, unit="km", distance_type="arc")
+
+
+def add_cursor_clauses(qb: QueryBuilder, request: CSSearchRequest, search_after=None, pit_id=None):
+    """
+    Deterministic sort for cursor pagination: distance (score without location), then station_id.
+    """
+    if request.location is not None:
+        add_distance_sort(qb, request)
+    else:
+        qb.add_sort("_score", order="desc")
+    qb.add_sort(CURSOR_TIEBREAK_FIELD)
+    if search_after is not None:
+        qb.add_search_after(search_after)
+    if pit_id is not None:
+        qb.add_pit(pit_id, keep_alive=PIT_KEEP_ALIVE)
+    return qb
+
+
+def encode_cursor(search_after: list, pit_id: str = None) -> str:
+    cursor = {"search_after": search_after}
+    if pit_id is not None:
+        cursor["pit_id"] = pit_id
+    return base64.urlsafe_b64encode(serializer.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> tuple:
+    """
+    Returns (search_after, pit_id) of the cursor, both None for no cursor or the first page.
+    """
+    if cursor is None or cursor == CURSOR_START:
+        return None, None
+    try:
+        decoded = serializer.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return decoded["search_after"], decoded.get("pit_id")
+    except (ValueError, TypeError, KeyError) as e:
+        raise SearchException(code=400, message="Invalid cursor.", detail_error=str(e))
+
+
+def distance_sorted(request: CSSearchRequest) -> bool:
+    return request.location is not None and bool(request.cursor or request.nearest)
+
+
+def cluster_precision(request: CSSearchRequest) -> Optional[int]:
+    """
+    Geohash precision of the clusters of a low zoom viewport request (None for documents), cells get
+    about 8 per 256px map tile. Ex. zoom 3 -> 2, zoom 12 -> 6
+    """
+    viewport = request.viewport
+    if viewport is None or viewport.zoom is None or viewport.zoom > CLUSTER_MAX_ZOOM:
+        return None
+    return max(1, (viewport.zoom + 1) // 2)
+
+
+def valid_point(value: list[float]) -> bool:
+    """
+    A [lon, lat] coordinate array OpenSearch accepts.
+    """
+    point = spatial.geo_point(value) if len(value) == 2 else None
+    return point is not None and -90 <= point[0] <= 90 and -180 <= point[1] <= 180
+
+
+def check_request(request: CSSearchRequest):
+    """
+    Rejects parameter combinations that cannot be searched together, and malformed viewports.
+    """
+    viewport = request.viewport
+    if viewport is not None:
+        if not valid_point(viewport.top_left) or not valid_point(viewport.bottom_right):
+            raise SearchException(code=400, message="viewport corners must be valid coordinates.")
+        if spatial.geo_point(viewport.top_left)[0] < spatial.geo_point(viewport.bottom_right)[0]:
+            raise SearchException(code=400, message="viewport top_left must not be below bottom_right.")
+        if viewport.zoom is not None and viewport.zoom < 0:
+            raise SearchException(code=400, message="viewport zoom must not be negative.")
+    if request.route is not None:
+        if not request.route.points or None in route_points(request) or request.route.buffer_km <= 0:
+            raise SearchException(code=400, message="route needs points and a positive buffer_km.")
+        if request.cursor or request.nearest or cluster_precision(request) is not None:
+            raise SearchException(code=400, message="route cannot be combined with cursor, nearest or clusters.")
+    if cluster_precision(request) is not None and (request.cursor or request.nearest):
+        raise SearchException(code=400, message="Clustered viewport searches cannot use cursor or nearest.")
+    if request.location is not None and request.proximity_in_km is None:
+        raise SearchException(code=400, message="proximity_in_km is required with a location.")
+    if request.proximity_in_km is not None and request.proximity_in_km <= 0:
+        raise SearchException(code=400, message="proximity_in_km must be positive.")
+    if request.nearest is None:
+        return
+    if not 1 <= request.nearest <= MAX_RESULT_WINDOW:
+        raise SearchException(code=400, message="nearest must be between 1 and {}.".format(MAX_RESULT_WINDOW))
+    if request.location is None:
+        raise SearchException(code=400, message="nearest requires a location.")
+    if request.cursor:
+        raise SearchException(code=400, message="nearest cannot be combined with cursor.")
+
+
+def nearest_radii(proximity_in_km: int) -> list[int]:
+    """
+    Radii of a nearest search, up to NEAREST_MAX_KM. Ex. nearest_radii(2) -> [2, 8, 32, 128, 512]
+    """
+    radii = [proximity_in_km]
+    while radii[-1] < NEAREST_MAX_KM:
+        radii.append(min(radii[-1] * NEAREST_GROWTH, NEAREST_MAX_KM))
+    return radii
+
+
+def source_fields(request: CSSearchRequest) -> Optional[list[str]]:
+    """
+    Route searches always include geo_address, stations are placed on the route by it.
+    """
+    fields = request.fields or (SOURCE_VIEWS[request.view] if request.view is not None else None)
+    if fields is not None and request.route is not None and "geo_address" not in fields:
+        fields = [*fields, "geo_address"]
+    return fields
+
+
+def query_builder(request: CSSearchRequest, search_after=None, pit_id=None, source=None,
+                  timeout=None, precision=None, corridor=None) -> QueryBuilder:
+    """
+    Builds the QueryBuilder object tree with the requested filters.
     Refer: helper#esqueryhelper.py and play with main method for better understanding.
     """
+    bool_query = Bool().add_must(must_query=add_multi_match_clause(request.search_by.text))
+    for field, attr in TERM_FILTERS:
+        bool_query.add_filter(filter_query=add_filter_clause(field, getattr(request.search_by, attr)))
+    bool_query.add_filter(filter_query=add_geo_clause(request))
+    bool_query.add_filter(filter_query=add_viewport_clause(request))
+    bool_query.add_filter(filter_query=add_corridor_clause(corridor))
+    if corridor is not None:
+        # ordered along the route in the service, offset and limit are applied there. Nearest to the start
+        # first, so a cut at CORRIDOR_MAX_HITS keeps a complete start of the route.
+        qb = QueryBuilder(frm=0, size=CORRIDOR_MAX_HITS).add_query(query_root=Query().add_bool(bool_query)) \
+            .add_sort("_geo_distance", geo_address=request.route.points[0], unit="km", distance_type="arc")
+    elif precision is not None:
+        # clusters only, no documents are fetched. total is the number of stations, counted in full.
+        qb = QueryBuilder(frm=0, size=0).add_query(query_root=Query().add_bool(bool_query)).add_track_total_hits()
+        add_cluster_aggregation(qb, precision)
+    else:
+        qb = QueryBuilder(frm=0 if request.cursor or request.nearest else request.offset,
+                          size=request.nearest or request.limit) \
+            .add_query(query_root=Query().add_bool(bool_query))
+    if request.cursor:
+        add_cursor_clauses(qb, request, search_after=search_after, pit_id=pit_id)
+    elif request.nearest:
+        add_distance_sort(qb, request).add_sort(CURSOR_TIEBREAK_FIELD)
+    if source is not None:
+        qb.add_source(includes=source)
+    if request.profile:
+        qb.add_profile()
+    if timeout is not None:
+        qb.add_timeout(timeout)
+    add_facet_aggregations(qb, facets(request))
+    return qb
+
+
+def query_shape(request: CSSearchRequest, search_after=None, pit_id=None, source=None, timeout=None,
+                precision=None, corridor=None) -> tuple:
+    """
+    Names of the request parameters present in the query, requests with the same shape share one template.
+    """
+    search_by = request.search_by
+    shape = ["text"] if search_by.text and len(search_by.text) > 0 else []
+    shape.extend(attr for _, attr in TERM_FILTERS if getattr(search_by, attr))
+    if request.location is not None:
+        shape.append("location")
+    if request.cursor:
+        shape.append("cursor")
+    if request.nearest:
+        shape.append("nearest")
+    if request.viewport is not None:
+        shape.append("viewport")
+    if precision is not None:
+        shape.append("precision")
+    if corridor is not None:
+        shape.append("corridor")
+    shape.extend("facet:" + facet.value for facet in facets(request))
+    if search_after is not None:
+        shape.append("search_after")
+    if pit_id is not None:
+        shape.append("pit_id")
+    if source is not None:
+        shape.append("source")
+    if request.profile:
+        shape.append("profile")
+    if timeout is not None:
+        shape.append("timeout")
+    return tuple(shape)
+
+
+def query_params(request: CSSearchRequest, search_after=None, pit_id=None, source=None, timeout=None,
+                 precision=None, corridor=None) -> dict:
+    """
+    Placeholder values of the query template, as they appear in the final query.
+    Only the parameters of the request's shape are set, its template has no placeholders for the others.
+    """
+    search_by = request.search_by
+    params = {"offset": request.offset, "limit": request.limit}
+    for attr, value in search_by.__dict__.items():
+        if value:
+            params[attr] = term_value(value)
+    if search_by.text:
+        params["text"] = search_by.text
+    if request.location is not None:
+        params["location"] = request.location
+        params["proximity_in_km"] = "{}km".format(request.proximity_in_km)
+    if request.viewport is not None:
+        params["top_left"] = request.viewport.top_left
+        params["bottom_right"] = request.viewport.bottom_right
+    if request.route is not None:
+        params["route_start"] = request.route.points[0]
+    optional = (("search_after", search_after), ("pit_id", pit_id), ("source", source), ("timeout", timeout),
+                ("nearest", request.nearest), ("precision", precision), ("corridor", corridor))
+    for name, value in optional:
+        if value is not None:
+            params[name] = value
+    return params
+
+
+@lru_cache(maxsize=None)
+def compile_query(shape: tuple) -> QueryTemplate:
+    """
+    Builds the query once for the shape with placeholders in place of the values.
+    """
+    ph = QueryTemplate.placeholder
+    request = CSSearchRequest.construct(offset=ph("offset"), limit=ph("limit"), proximity_in_km=ph("proximity_in_km"),
+                                        location=ph("location") if "location" in shape else None,
+                                        cursor=ph("cursor") if "cursor" in shape else None,
+                                        nearest=ph("nearest") if "nearest" in shape else None,
+                                        viewport=Viewport.construct(top_left=ph("top_left"),
+                                                                    bottom_right=ph("bottom_right"))
+                                        if "viewport" in shape else None,
+                                        route=RouteCorridor.construct(points=[ph("route_start")])
+                                        if "corridor" in shape else None,
+                                        profile="profile" in shape,
+                                        aggregations=[Facet(name[len("facet:"):]) for name in shape
+                                                      if name.startswith("facet:")],
+                                        search_by=SearchBy.construct(**{attr: ph(attr) for attr in shape
+                                                                        if attr in SearchBy.__fields__}))
+    return QueryTemplate(query_builder(request,
+                                       search_after=ph("search_after") if "search_after" in shape else None,
+                                       pit_id=ph("pit_id") if "pit_id" in shape else None,
+                                       source=ph("source") if "source" in shape else None,
+                                       timeout=ph("timeout") if "timeout" in shape else None,
+                                       precision=ph("precision") if "precision" in shape else None,
+                                       corridor=ph("corridor") if "corridor" in shape else None).build())
+
+
+def build_query(request: CSSearchRequest, pit_id: str = None, timeout: str = None) -> str:
+    """
+    Method to build dynamic OS Query with the requested filters.
+    The query tree is built once per filter shape (see compile_query), later calls only fill in the values.
+    pit_id overrides the point in time of the cursor, it is set for the first page of a pit request.
+    timeout is the shard level time limit. Ex. "1500ms"
+    """
+    search_after, cursor_pit_id = decode_cursor(request.cursor)
+    pit_id = pit_id or cursor_pit_id
+    source = source_fields(request)
+    precision = cluster_precision(request)
+    corridor = corridor_clauses(request) if request.route is not None else None
+    return compile_query(query_shape(request, search_after, pit_id, source, timeout, precision, corridor)) \
+        .render(query_params(request, search_after, pit_id, source, timeout, precision, corridor))
+
+
+def cache_key(request: CSSearchRequest, cell_ratio: float = 0.1) -> tuple:
+    """
+    Normalized cache key for the request. Location is snapped to a geohash cell sized
+    from proximity_in_km (cell width <= proximity * cell_ratio), so nearby polls share a key.
+    Distance sorted results (nearest, cursor pages) depend on the exact origin, their key keeps the location.
+    """
+    cell = None
+    point = spatial.geo_point(request.location) if request.location is not None else None
+    if request.location is not None and (distance_sorted(request) or point is None):
+        cell = tuple(request.location)
+    elif point is not None:
+        precision = geohash.precision_for_km(request.proximity_in_km * cell_ratio)
+        cell = geohash.encode(point[0], point[1], precision)
+    # the same normalization as the query, text is analyzed by OpenSearch (case and spacing do not matter).
+    search_by = tuple((key, term_value(value)) for key, value in sorted(request.search_by.dict().items())
+                      if value is not None) if request.search_by else ()
+    fields = tuple(source_fields(request) or ())
+    viewport = (tuple(request.viewport.top_left), tuple(request.viewport.bottom_right), request.viewport.zoom) \
+        if request.viewport else None
+    route = (tuple(map(tuple, request.route.points)), request.route.buffer_km) if request.route else None
+    return cell, request.proximity_in_km, request.offset, request.limit, search_by, request.cursor, fields, \
+        request.nearest, viewport, route, tuple(facets(request))
+
+
+def search_error(e: Exception) -> SearchException:
+    """
+    SearchException for an OpenSearch client error. Requests OpenSearch rejected as invalid (4xx) are the
+    client's error, 400, they do not count against the circuit breaker. 429 means OpenSearch is overloaded.
+    """
+    if isinstance(e, ConnectionTimeout):
+        return SearchException(code=504, message="OpenSearch did not respond in time.", detail_error=str(e))
+    status = e.status_code if isinstance(e, TransportError) else None
+    if status == 429:
+        return SearchException(code=503, message="OpenSearch is overloaded, retry later.", detail_error=str(e))
+    if isinstance(status, int) and 400 <= status < 500:
+        return SearchException(code=400, message="Invalid search request.", detail_error=str(e))
+    return SearchException(code=500, message="Internal server error while searching", detail_error=str(e))
+
+
+def reshape_hit(rec: dict, distance: bool = False) -> dict:
+    hit = {"id": rec["_id"], "score": rec["_score"] if rec["_score"] is not None else 0.0,
+           "charge_station": rec["_source"]}
+    if distance:
+        hit["distance_km"] = rec["sort"][0]
+    return hit
+
+
+def reshape_cluster(bucket: dict) -> dict:
+    centroid = bucket["centroid"]["location"]
+    # lon first, the order OpenSearch reads coordinate arrays in, same as the request location.
+    return {"geohash": bucket["key"], "count": bucket["doc_count"], "location": [centroid["lon"], centroid["lat"]]}
 
-    qb = QueryBuilder(frm=request.offset, size=request.limit)
-    qb.add_query(query_root=Query()
-                 .add_bool(bool_query=Bool()
-                           .add_must(must_query=add_multi_match_clause(request.search_by.text))
-                           .add_filter(filter_query=add_filter_clause("name", request.search_by.name))
-                           .add_filter(filter_query=add_filter_clause("address_line", request.search_by.area))
-                           .add_filter(filter_query=add_filter_clause("country", request.search_by.country))
-                           .add_filter(filter_query=add_filter_clause("state", request.search_by.state))
-                           .add_filter(filter_query=add_filter_clause("town", request.search_by.city))
-                           .add_filter(filter_query=add_filter_clause("rating.avg_rating",
-                                                                      request.search_by.avg_rating))
-                           .add_filter(filter_query=add_filter_clause("total_charger_data.charger_point_type",
-                                                                      request.search_by.charger_point_type))
-                           .add_filter(filter_query=add_filter_clause("postal_code", request.search_by.pincode))
-                           .add_filter(filter_query=add_filter_clause("total_charger_data.power_capacity",
-                                                                      request.search_by.power_capacity))
-                           .add_filter(filter_query=add_filter_clause("total_charger_data.connectors.status",
-                                                                      request.search_by.connector_status))
-                           .add_filter(filter_query=add_geo_clause(request))))
-    return qb.build()
+
+def reshape_bucket(bucket: dict) -> dict:
+    return {"value": bucket.get("key_as_string", bucket["key"]), "count": bucket["doc_count"]}
+
+
+def reshape_response(response: dict, page_size: int = None, distance: bool = False) -> dict:
+    """
+    Maps an OpenSearch search response (or one _msearch item) to a plain dict with the CSSearchResult fields,
+    without building or validating models. _source documents are passed through as they are.
+    page_size is set for cursor requests, a full page gets next_cursor from the sort values of its last hit.
+    partial is set when shards timed out or failed, the hits are then incomplete.
+    distance is set when hits are sorted by distance first, records then carry distance_km.
+    clusters are set for a clustered viewport request (cluster aggregation in the response), aggregations
+    for the facets of the request (all other aggregations).
+    """
+    if "error" in response:
+        raise SearchException(code=response.get("status", 500), message="Search failed for the request.",
+                              detail_error=serializer.dumps(response["error"]))
+    if response["hits"] is None:
+        raise SearchException(code=404, message="No Records found for filter criteria.")
+
+    hits = response["hits"]["hits"]
+    next_cursor = None
+    if page_size and len(hits) == page_size and "sort" in hits[-1]:
+        next_cursor = encode_cursor(hits[-1]["sort"], response.get("pit_id"))
+    timed_out = response.get("timed_out", False)
+    aggregations = response.get("aggregations", {})
+    clusters = aggregations.get("clusters")
+    facet_buckets = {name: [reshape_bucket(bucket) for bucket in aggregation["buckets"]]
+                     for name, aggregation in aggregations.items() if name != "clusters"}
+    return {
+        "took": response["took"],
+        "total": response["hits"]["total"]["value"],
+        "max_score": response["hits"]["max_score"] if response["hits"]["max_score"] else 0.0,
+        "records": [reshape_hit(rec, distance) for rec in hits],
+        "next_cursor": next_cursor,
+        "profile": response.get("profile"),
+        "timed_out": timed_out,
+        "partial": timed_out or response.get("_shards", {}).get("failed", 0) > 0,
+        "stale": False,
+        "clusters": [reshape_cluster(bucket) for bucket in clusters["buckets"]] if clusters else None,
+        "aggregations": facet_buckets or None
+    }
 
 
 class CSSearchService:
     __index_name__ = "charging_stations"
 
-    def __init__(self, os_client: OpenSearch, logger: logging.Logger):
+    def __init__(self, os_client: Union[AsyncOpenSearch, OpenSearch], logger: logging.Logger,
+                 cache: TTLCache = None, batcher: MicroBatcher = None, singleflight: SingleFlight = None,
+                 slow_log: SlowQueryLog = None, limiter: ConcurrencyLimiter = None, timeout_ms: float = None,
+                 shard_timeout_ms: float = None, hedger: Hedger = None, breaker: CircuitBreaker = None,
+                 stale_cache: TTLCache = None, replica: "StationReplica" = None):
         self.os_client = os_client
         self.logger = logger
+        self.cache = cache
+        self.batcher = batcher
+        self.singleflight = singleflight
+        self.slow_log = slow_log
+        self.limiter = limiter
+        self.timeout_ms = timeout_ms
+        self.shard_timeout_ms = shard_timeout_ms
+        self.hedger = hedger
+        self.breaker = breaker
+        self.stale_cache = stale_cache
+        self.replica = replica
 
     """
     Search Service Implementation class.
     All Business logic goes here.
+    os_client can be AsyncOpenSearch or the blocking OpenSearch client, async client calls are awaited.
+    With a batcher, concurrent searches are coalesced into _msearch calls (see msearch_queries).
+    With singleflight, callers with an identical query in flight share its result.
+    With slow_log, executed searches over its threshold are logged with their query.
+    With limiter, OpenSearch calls of search and msearch go through admission control, cache hits do not.
+    timeout_ms is the deadline of a search (queueing included), shard_timeout_ms the OpenSearch timeout
+    after which shards return partial results, keep it below timeout_ms.
+    With hedger, a slow search is sent again with another preference and the first response is used.
+    With breaker, OpenSearch calls fail fast while it is open. With stale_cache, the last good result of a
+    request is kept and returned (stale) when OpenSearch fails or the breaker is open.
+    With replica, location and term filter searches it can answer are served in-process, without OpenSearch.
     """
 
-    async def search(self, request: CSSearchRequest) -> CSSearchResult:
-        # Use os_client to search
+    @staticmethod
+    async def _resolve(response):
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+    async def _os_call(self, method: str, body, index=__index_name__, **params) -> dict:
+        """
+        Records the round trip, and its split into OpenSearch took and network (plus client) overhead.
+        """
+        started = time.perf_counter()
+        try:
+            with metrics.OS_IN_FLIGHT.track():
+                response = await self._resolve(getattr(self.os_client, method)(body=body, index=index, **params))
+        except Exception:
+            metrics.OS_ERRORS.inc()
+            raise
+        round_trip = time.perf_counter() - started
+        metrics.record("opensearch", round_trip)
+        took = response.get("took") if isinstance(response, dict) else None
+        if isinstance(took, (int, float)):
+            metrics.record("opensearch_took", took / 1000)
+            metrics.record("network", max(round_trip - took / 1000, 0.0))
+        return response
+
+    async def _admitted(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Admission control, then the circuit breaker, around an OpenSearch call.
+        """
+        if self.breaker is not None:
+            guarded = fn
+            fn = lambda: self.breaker.run(guarded)
+        if self.limiter is None:
+            return await fn()
+        return await self.limiter.run(fn)
+
+    @staticmethod
+    def is_failure(e: Exception) -> bool:
+        """
+        Errors that count against the circuit breaker and allow a stale result: OpenSearch failures,
+        not rejected or invalid requests.
+        """
+        if isinstance(e, SearchRejectedException):
+            return isinstance(e, CircuitOpenException)
+        return not isinstance(e, SearchException) or e.code >= 500
+
+    def _stale(self, key) -> Optional[dict]:
+        if self.stale_cache is None or key is None:
+            return None
+        cs_result = self.stale_cache.get(key)
+        return {**cs_result, "stale": True} if cs_result is not None else None
+
+    async def _within_deadline(self, awaitable: Awaitable[Any]) -> Any:
+        if not self.timeout_ms:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, self.timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            raise SearchException(code=504, message="Search did not complete within {}ms.".format(self.timeout_ms))
+
+    def _shard_timeout(self) -> Optional[str]:
+        return "{}ms".format(int(self.shard_timeout_ms)) if self.shard_timeout_ms else None
+
+    async def warm_up(self, connections: int = 1) -> int:
+        """
+        Opens up to `connections` pooled connections to OpenSearch (TLS handshake included) ahead of the first search.
+        Returns the number of successful pings.
+        """
+        results = await asyncio.gather(*(self._resolve(self.os_client.ping()) for _ in range(connections)),
+                                       return_exceptions=True)
+        return sum(1 for result in results if result is True)
+
+    async def _create_pit(self) -> str:
+        response = await self._resolve(self.os_client.transport.perform_request(
+            "POST", "/{}/_search/point_in_time".format(CSSearchService.__index_name__),
+            params={"keep_alive": PIT_KEEP_ALIVE}))
+        return response["pit_id"]
+
+    async def _delete_pit(self, pit_id: str):
+        try:
+            await self._resolve(self.os_client.transport.perform_request(
+                "DELETE", "/_search/point_in_time", body={"pit_id": [pit_id]}))
+        except Exception as e:
+            self.logger.warning("Could not delete point in time: %s", e)
+
+    async def search(self, request: CSSearchRequest, passthrough: bool = False) -> Union[CSSearchResult, dict]:
+        """
+        passthrough returns the plain dict of reshape_response (CSSearchResult fields) instead of the model,
+        it skips per hit model creation and validation. Cache and single-flight share the plain dict.
+        A nearest search is repeated with a growing radius (see nearest_radii) until it finds k stations.
+        """
         if request is None:
             raise SearchException(code=400, message="Invalid request, Search Request body cannot be null.")
-        query = build_query(request)
-        print(query)
+        check_request(request)
+        if not request.nearest:
+            return await self._search(request, passthrough)
+        for radius in nearest_radii(request.proximity_in_km):
+            cs_result = await self._search(request.copy(update={"proximity_in_km": radius}), passthrough=True)
+            if len(cs_result["records"]) >= request.nearest:
+                break
+        return cs_result if passthrough else CSSearchResult(**cs_result)
+
+    async def _search(self, request: CSSearchRequest, passthrough: bool) -> Union[CSSearchResult, dict]:
+        if self.replica is not None and self.replica.can_answer(request):
+            cs_result = self.replica.search(request)
+            return cs_result if passthrough else CSSearchResult(**cs_result)
+        key = None
+        if (self.cache is not None or self.stale_cache is not None) and not request.pit and not request.profile:
+            key = cache_key(request)
+        if self.cache is not None and key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached if passthrough else CSSearchResult(**cached)
+        pit_id = decode_cursor(request.cursor)[1]
+        if request.pit and request.cursor == CURSOR_START:
+            try:
+                pit_id = await self._create_pit()
+            except Exception as e:
+                raise SearchException(code=500, message="Could not create point in time", detail_error=str(e))
+        with metrics.timed("build_query"):
+            query = build_query(request, pit_id=pit_id, timeout=self._shard_timeout())
+        page_size = request.limit if request.cursor else None
+        distance = distance_sorted(request) or request.route is not None
+        # a point in time search names its index in the pit, not in the path
+        index = None if pit_id else CSSearchService.__index_name__
+        started = time.perf_counter()
+        try:
+            if self.singleflight is not None:
+                cs_result = await self._within_deadline(self.singleflight.do(
+                    query, lambda: self._admitted(lambda: self._execute(query, page_size, index, distance))))
+            else:
+                cs_result = await self._within_deadline(
+                    self._admitted(lambda: self._execute(query, page_size, index, distance)))
+        except SearchException as se:
+            stale = self._stale(key) if self.is_failure(se) else None
+            if stale is None:
+                raise
+            self.logger.warning("Serving a stale result: %s", se.message)
+            return stale if passthrough else CSSearchResult(**stale)
+        if request.route is not None:
+            cs_result = order_along_route(cs_result, request)
+        if self.slow_log is not None:
+            self.slow_log.observe((time.perf_counter() - started) * 1000, cs_result["took"], cs_result["total"],
+                                  query_shape(request), query)
+        # a partial result is not cached, the next poll may get the full one.
+        if key is not None and not cs_result["partial"]:
+            if self.cache is not None:
+                self.cache.put(key, cs_result)
+            if self.stale_cache is not None:
+                self.stale_cache.put(key, cs_result)
+        return cs_result if passthrough else CSSearchResult(**cs_result)
+
+    async def _execute(self, query: str, page_size: int = None, index=__index_name__, distance: bool = False) -> dict:
+        try:
+            if self.batcher is not None and index is not None:
+                response = await self.batcher.submit(query)
+            else:
+                params = {"request_timeout": self.timeout_ms / 1000} if self.timeout_ms else {}
+                if self.hedger is not None:
+                    response = await self.hedger.run(lambda preference: self._os_call(
+                        "search", query, index=index, preference=preference, **params))
+                else:
+                    response = await self._os_call("search", query, index=index, **params)
+            with metrics.timed("reshape"):
+                return reshape_response(response, page_size, distance)
+        except SearchException:
+            raise
+        except Exception as e:
+            raise search_error(e)
+
+    async def stream(self, request: CSSearchRequest, chunk_size: int = 500) -> AsyncIterator[list[dict]]:
+        """
+        Yields matching documents chunk by chunk (up to request.limit documents), paging with search_after,
+        so memory stays flat in the result size. Documents are plain dicts with the CSDocs fields.
+        Each page is admitted, guarded by the breaker and bounded by the deadline like a search.
+        """
+        async def fetch(query: str, index) -> dict:
+            try:
+                params = {"request_timeout": self.timeout_ms / 1000} if self.timeout_ms else {}
+                return await self._os_call("search", query, index=index, **params)
+            except Exception as e:
+                raise search_error(e)
+
+        remaining = request.limit
+        cursor = CURSOR_START
+        pit_id = None
         try:
-            response = self.os_client.search(
-                body=query,
-                index=CSSearchService.__index_name__
-            )
-
-            if response["hits"] is None:
-                raise SearchException(code=404, message="No Records found for filter criteria.")
-
-            docs = []
-            for rec in response["hits"]["hits"]:
-                doc = CSDocs(
-                    id=rec["_id"],
-                    score=rec["_score"],
-                    charge_station=rec["_source"]
-                )
-                docs.append(doc)
+            if request.pit:
+                pit_id = await self._create_pit()
+            while remaining > 0:
+                page = request.copy(update={"cursor": cursor, "limit": min(chunk_size, remaining)})
+                query = build_query(page, pit_id=pit_id, timeout=self._shard_timeout())
+                index = None if pit_id else CSSearchService.__index_name__
+                response = await self._within_deadline(self._admitted(lambda: fetch(query, index)))
+                hits = response["hits"]["hits"]
+                if hits:
+                    yield [reshape_hit(rec, request.location is not None) for rec in hits]
+                if len(hits) < page.limit:
+                    break
+                remaining -= len(hits)
+                pit_id = response.get("pit_id", pit_id)
+                cursor = encode_cursor(hits[-1]["sort"], pit_id)
+        except SearchException:
+            raise
         except Exception as e:
-            raise SearchException(code=500, message="Internal server error while searching", detail_error=str(e))
-        cs_result = CSSearchResult(
-            took=response["took"],
-            total=response["hits"]["total"]["value"],
-            max_score=response["hits"]["max_score"] if response["hits"]["max_score"] else 0.0,
-            records=docs
-        )
-        return cs_result
+            raise search_error(e)
+        finally:
+            if pit_id is not None:
+                await self._delete_pit(pit_id)
+
+    async def msearch_queries(self, queries: list[str]) -> list[dict]:
+        """
+        Sends built queries in one _msearch call and returns the raw response items in the same order.
+        """
+        body = "".join("{}\n" + query + "\n" for query in queries)
+        params = {"request_timeout": self.timeout_ms / 1000} if self.timeout_ms else {}
+        response = await self._os_call("msearch", body, **params)
+        return response["responses"]
+
+    async def _msearch_round_trip(self, queries: list[str]) -> list[dict]:
+        try:
+            return await self.msearch_queries(queries)
+        except Exception as e:
+            raise search_error(e)
+
+    async def msearch(self, requests: list[CSSearchRequest]) -> list[CSBatchResult]:
+        """
+        Runs all requests in one _msearch round trip, results are returned in request order.
+        A failed item carries its error, cached items are not sent to OpenSearch.
+        Point in time (pit) requests are rejected, they need their own round trips to create the pit.
+        """
+        results = [None] * len(requests)
+        keys = [None] * len(requests)
+        pending = []
+        queries = []
+        for i, request in enumerate(requests):
+            try:
+                check_request(request)
+                if request.pit:
+                    raise SearchException(code=400, message="pit is not supported in batch searches.")
+            except SearchException as se:
+                results[i] = CSBatchResult(error=CSSearchError(code=se.code, message=se.message,
+                                                               detail_error=se.detail_error))
+                continue
+            if self.replica is not None and self.replica.can_answer(request):
+                results[i] = CSBatchResult(result=CSSearchResult(**self.replica.search(request)))
+                continue
+            if (self.cache is not None or self.stale_cache is not None) and not request.profile:
+                keys[i] = cache_key(request)
+            if self.cache is not None and keys[i] is not None:
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    results[i] = CSBatchResult(result=CSSearchResult(**cached))
+                    continue
+            try:
+                queries.append(build_query(request, timeout=self._shard_timeout()))
+            except SearchException as se:
+                results[i] = CSBatchResult(error=CSSearchError(code=se.code, message=se.message,
+                                                               detail_error=se.detail_error))
+                continue
+            pending.append(i)
+        if not pending:
+            return await self._grow_nearest(requests, results)
+
+        try:
+            responses = await self._within_deadline(self._admitted(lambda: self._msearch_round_trip(queries)))
+        except SearchException as se:
+            stale = [self._stale(keys[i]) for i in pending] if self.is_failure(se) else []
+            if not any(stale):
+                raise
+            self.logger.warning("Serving stale batch results: %s", se.message)
+            error = CSSearchError(code=se.code, message=se.message, detail_error=se.detail_error)
+            for i, cs_result in zip(pending, stale):
+                results[i] = CSBatchResult(result=CSSearchResult(**cs_result)) if cs_result \
+                    else CSBatchResult(error=error)
+            return results
+
+        for i, item in zip(pending, responses):
+            try:
+                cs_result = reshape_response(item, requests[i].limit if requests[i].cursor else None,
+                                             distance_sorted(requests[i]) or requests[i].route is not None)
+                if requests[i].route is not None:
+                    cs_result = order_along_route(cs_result, requests[i])
+            except SearchException as se:
+                results[i] = CSBatchResult(error=CSSearchError(code=se.code, message=se.message,
+                                                               detail_error=se.detail_error))
+                continue
+            except Exception as e:
+                results[i] = CSBatchResult(error=CSSearchError(code=500,
+                                                               message="Internal server error while searching",
+                                                               detail_error=str(e)))
+                continue
+            if keys[i] is not None and not cs_result["partial"]:
+                if self.cache is not None:
+                    self.cache.put(keys[i], cs_result)
+                if self.stale_cache is not None:
+                    self.stale_cache.put(keys[i], cs_result)
+            results[i] = CSBatchResult(result=CSSearchResult(**cs_result))
+        return await self._grow_nearest(requests, results)
+
+    async def _grow_nearest(self, requests: list[CSSearchRequest], results: list[CSBatchResult]) -> list[CSBatchResult]:
+        """
+        nearest items of a batch that found fewer than k stations at their radius continue as single searches
+        from the next radius.
+        """
+        grow = [i for i, request in enumerate(requests) if request.nearest and results[i].result is not None
+                and len(results[i].result.records) < request.nearest
+                and request.proximity_in_km < NEAREST_MAX_KM]
+        grown = await asyncio.gather(*(self.search(requests[i].copy(update={"proximity_in_km": nearest_radii(
+            requests[i].proximity_in_km)[1]})) for i in grow), return_exceptions=True)
+        for i, cs_result in zip(grow, grown):
+            if isinstance(cs_result, SearchException):
+                results[i] = CSBatchResult(error=CSSearchError(code=cs_result.code, message=cs_result.message,
+                                                               detail_error=cs_result.detail_error))
+            elif isinstance(cs_result, Exception):
+                raise cs_result
+            else:
+                results[i] = CSBatchResult(result=cs_result)
+        return results
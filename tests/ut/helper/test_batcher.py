@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+
+from app.helper.batcher import MicroBatcher
+
+
+class MicroBatcherTestCase(unittest.TestCase):
+
+    def test_coalesces_concurrent_submits(self):
+        calls = []
+
+        async def flush(items):
+            calls.append(items)
+            return [item * 10 for item in items]
+
+        async def run():
+            batcher = MicroBatcher(flush=flush, window_ms=5, max_size=10)
+            return await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+
+        self.assertEqual([0, 10, 20, 30], asyncio.run(run()))
+        self.assertEqual([[0, 1, 2, 3]], calls)
+
+    def test_flushes_at_max_size(self):
+        calls = []
+
+        async def flush(items):
+            calls.append(items)
+            return items
+
+        async def run():
+            batcher = MicroBatcher(flush=flush, window_ms=1000, max_size=2)
+            return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), timeout=1)
+
+        self.assertEqual([0, 1, 2, 3], asyncio.run(run()))
+        self.assertEqual([[0, 1], [2, 3]], calls)
+
+    def test_flush_error_is_raised_to_callers(self):
+        async def flush(items):
+            raise ValueError("boom")
+
+        async def run():
+            batcher = MicroBatcher(flush=flush, window_ms=1)
+            return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+
+from app.exception.customexception import CircuitOpenException
+from app.helper.breaker import CircuitBreaker, CLOSED, OPEN
+
+
+async def fail():
+    raise RuntimeError("OpenSearch down")
+
+
+async def succeed():
+    return "ok"
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def run_call(self, breaker, fn):
+        try:
+            return asyncio.run(breaker.run(fn))
+        except Exception as e:
+            return e
+
+    def test_opens_after_failures_and_fails_fast(self):
+        breaker = CircuitBreaker(failure_threshold=2, open_seconds=60)
+        self.run_call(breaker, fail)
+        self.assertEqual(CLOSED, breaker.state)
+        self.run_call(breaker, fail)
+        self.assertEqual(OPEN, breaker.state)
+        error = self.run_call(breaker, succeed)
+        self.assertIsInstance(error, CircuitOpenException)
+        self.assertEqual(503, error.code)
+        self.assertGreater(error.retry_after, 50)
+        self.assertEqual(1, breaker.stats()["short_circuited"])
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, open_seconds=0)
+        self.run_call(breaker, fail)
+        self.assertEqual(OPEN, breaker.state)
+        # open_seconds elapsed, a failed probe opens it again, a successful one closes it.
+        self.run_call(breaker, fail)
+        self.assertEqual((OPEN, 2), (breaker.state, breaker.opened))
+        self.assertEqual("ok", self.run_call(breaker, succeed))
+        self.assertEqual(CLOSED, breaker.state)
+
+    def test_slow_calls_and_ignored_errors(self):
+        async def slow():
+            await asyncio.sleep(0.02)
+
+        breaker = CircuitBreaker(failure_threshold=1, slow_call_ms=10, open_seconds=60,
+                                 is_failure=lambda e: not isinstance(e, ValueError))
+
+        async def invalid():
+            raise ValueError("bad request")
+
+        self.run_call(breaker, invalid)
+        self.assertEqual(CLOSED, breaker.state)
+        self.run_call(breaker, slow)
+        self.assertEqual(OPEN, breaker.state)
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+
+from app.helper import geohash
+from app.helper.cache import TTLCache
+
+
+class TTLCacheTestCase(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = TTLCache(max_size=2, ttl_seconds=30)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(0.5, cache.stats()["hit_rate"])
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_size=2, ttl_seconds=30)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(1, cache.evictions)
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(max_size=2, ttl_seconds=5)
+        with patch("app.helper.cache.time.monotonic", return_value=100.0):
+            cache.put("a", 1)
+        with patch("app.helper.cache.time.monotonic", return_value=106.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(1, cache.expirations)
+        self.assertEqual(0, len(cache))
+
+    def test_disabled_cache(self):
+        cache = TTLCache(max_size=0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+class GeohashTestCase(unittest.TestCase):
+
+    def test_encode(self):
+        self.assertEqual("u4pruydqqvj", geohash.encode(57.64911, 10.40744, 11))
+        self.assertEqual("u4pru", geohash.encode(57.64911, 10.40744, 5))
+
+    def test_precision_for_km(self):
+        self.assertEqual(7, geohash.precision_for_km(0.2))
+        self.assertEqual(5, geohash.precision_for_km(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 import json
 import unittest
 
-from app.helper.esqueryhelper import QueryBuilder, Query, Bool, Must, Filter, Shape
+from app.helper.esqueryhelper import QueryBuilder, Query, Bool, Must, Filter, Shape, QueryTemplate
 
 
 class QueryBuilderTestCase(unittest.TestCase):
@@ -15,7 +15,7 @@ class QueryBuilderTestCase(unittest.TestCase):
             "title": {"query": "Title Field value", "analyzer": "standard", "fuzziness": "AUTO", "operator": "AND",
                       "fuzzy_transpositions": True, "minimum_should_match": 1, "zero_terms_query": "none",
                       "max_expansions": 50, "boost": 1}}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_multi_match_query_with_filter(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -38,7 +38,7 @@ class QueryBuilderTestCase(unittest.TestCase):
                                                                                          "boost": 1,
                                                                "auto_generate_synonyms_phrase_query": True}}],
                                                                "filter": [{"term": {"name": "Avol"}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_match_all(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -48,7 +48,7 @@ class QueryBuilderTestCase(unittest.TestCase):
                                            .add_match_all()))) \
             .build()
         expected = {"from": 0, "size": 100, "query": {"bool": {"must": [{"match_all": {}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_match(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -61,7 +61,7 @@ class QueryBuilderTestCase(unittest.TestCase):
             "title": {"query": "fake title value", "analyzer": "standard", "fuzziness": "AUTO", "operator": "AND",
                       "fuzzy_transpositions": True, "minimum_should_match": 1, "zero_terms_query": "none",
                       "max_expansions": 50, "boost": 1}}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_multi_match(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -83,7 +83,7 @@ class QueryBuilderTestCase(unittest.TestCase):
                                                                                          "boost": 1,
                                                                "auto_generate_synonyms_phrase_query": True}}]}}}
         print(self.query)
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_filter(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -93,7 +93,7 @@ class QueryBuilderTestCase(unittest.TestCase):
                                              .add_term(field="title", value="fake title value")))) \
             .build()
         expected = {"from": 0, "size": 100, "query": {"bool": {"filter": [{"term": {"title": "fake title value"}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_filter_geo_distance(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -106,7 +106,7 @@ class QueryBuilderTestCase(unittest.TestCase):
             .build()
         expected = {"from": 0, "size": 100, "query": {"bool": {"filter": [
             {"geo_distance": {"distance_type": "arc", "distance": "2km", "geo_address": [12.324566, -77.55454564]}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_filter_geo_shape(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -124,7 +124,7 @@ class QueryBuilderTestCase(unittest.TestCase):
             "shape": {"type": "envelope",
                       "coordinates": [[12.982000358725655, 77.78515215905627], [12.994461946282915, 77.77772780479991]],
                       "relation": "intersects"}}}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
 
     def test_bool_query_with_match_geo_filters(self):
         self.query = QueryBuilder(frm=0, size=100) \
@@ -149,7 +149,44 @@ class QueryBuilderTestCase(unittest.TestCase):
                                                      "coordinates": [[12.982000358725655, 77.78515215905627],
                                                                      [12.994461946282915, 77.77772780479991]],
                                                      "relation": "intersects"}}}}]}}}
-        self.assertEqual(json.dumps(expected), self.query)
+        self.assertEqual(expected, json.loads(self.query))
+
+    def test_sort_with_search_after_and_pit(self):
+        self.query = QueryBuilder(frm=0, size=10) \
+            .add_query(query_root=Query().add_bool(bool_query=Bool().add_must(must_query=Must().add_match_all()))) \
+            .add_sort("_score", order="desc") \
+            .add_sort("station_id.keyword") \
+            .add_search_after([1.2, "115"]) \
+            .add_pit("pit-id", keep_alive="5m") \
+            .build()
+        expected = {"from": 0, "size": 10, "query": {"bool": {"must": [{"match_all": {}}]}},
+                    "sort": [{"_score": {"order": "desc"}}, {"station_id.keyword": {"order": "asc"}}],
+                    "search_after": [1.2, "115"], "pit": {"id": "pit-id", "keep_alive": "5m"}}
+        self.assertEqual(expected, json.loads(self.query))
+
+    def test_source_filtering(self):
+        self.query = QueryBuilder(frm=0, size=10) \
+            .add_query(query_root=Query().add_bool(bool_query=Bool().add_must(must_query=Must().add_match_all()))) \
+            .add_source(includes=["name", "geo_address"], excludes=["available_chargers"]) \
+            .build()
+        expected = {"from": 0, "size": 10, "query": {"bool": {"must": [{"match_all": {}}]}},
+                    "_source": {"includes": ["name", "geo_address"], "excludes": ["available_chargers"]}}
+        self.assertEqual(expected, json.loads(self.query))
+
+    def test_query_template(self):
+        template = QueryTemplate(QueryBuilder(frm=QueryTemplate.placeholder("offset"), size=100)
+                                 .add_query(query_root=Query()
+                                            .add_bool(bool_query=Bool()
+                                                      .add_filter(filter_query=Filter()
+                                                                  .add_geo_distance(
+                                                                      field="geo_address",
+                                                                      coordinates=QueryTemplate.placeholder("point"),
+                                                                      distance="__tpl_distance__km")))).build())
+        self.assertEqual(["offset", "distance", "point"], template.params)
+        expected = {"from": 20, "size": 100, "query": {"bool": {"filter": [
+            {"geo_distance": {"distance_type": "arc", "distance": "5km", "geo_address": [12.324566, -77.55454564]}}]}}}
+        self.assertEqual(expected, json.loads(
+            template.render({"offset": 20, "point": [12.324566, -77.55454564], "distance": "5km"})))
 
 
 if __name__ == '__main__':
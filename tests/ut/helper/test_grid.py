@@ -0,0 +1,42 @@
+import math
+import random
+import unittest
+
+from app.helper.grid import np, haversine_km, GridIndex
+
+
+def brute_force(latitude, longitude, radius_km, points):
+    distances = haversine_km(latitude, longitude, np.array([p[0] for p in points]), np.array([p[1] for p in points]))
+    return sorted(int(i) for i in np.flatnonzero(distances <= radius_km))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class GridTestSuite(unittest.TestCase):
+
+    def test_haversine_km(self):
+        # one degree of latitude along a meridian
+        distance = haversine_km(0.0, 0.0, np.array([1.0]), np.array([0.0]))[0]
+        self.assertAlmostEqual(math.pi * 6371.0087714 / 180, distance, places=6)
+
+    def test_within_matches_brute_force(self):
+        rnd = random.Random(7)
+        points = [(12.9 + rnd.random() * 0.3, 77.5 + rnd.random() * 0.3) for _ in range(2000)]
+        grid = GridIndex([p[0] for p in points], [p[1] for p in points], cell_deg=0.05)
+        for radius_km in (0.5, 2, 10, 40):
+            positions, distances = grid.within(13.0, 77.6, radius_km)
+            self.assertEqual(brute_force(13.0, 77.6, radius_km, points), sorted(positions.tolist()))
+            self.assertTrue(np.all(np.diff(distances) >= 0))
+
+    def test_within_subset(self):
+        grid = GridIndex([10.0, 10.001, 10.002], [20.0, 20.0, 20.0])
+        positions, _ = grid.within(10.0, 20.0, 1.0, subset=np.array([0, 2]))
+        self.assertEqual([0, 2], positions.tolist())
+
+    def test_within_across_antimeridian(self):
+        grid = GridIndex([0.0, 0.0, 0.0], [179.999, -179.999, 0.0])
+        positions, _ = grid.within(0.0, 179.9995, 1.0)
+        self.assertEqual([0, 1], sorted(positions.tolist()))
+
+
+if __name__ == '__main__':
+    unittest.main()
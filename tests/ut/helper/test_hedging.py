@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+
+from app.helper.hedging import Hedger
+
+
+class HedgerTestCase(unittest.TestCase):
+
+    def test_fast_call_is_not_hedged(self):
+        preferences = []
+
+        async def call(preference):
+            preferences.append(preference)
+            return "primary"
+
+        hedger = Hedger(default_delay_ms=50)
+        self.assertEqual("primary", asyncio.run(hedger.run(call)))
+        self.assertEqual([None], preferences)
+        self.assertEqual(0, hedger.hedged)
+
+    def test_slow_call_is_hedged_and_cancelled(self):
+        cancelled = []
+
+        async def call(preference):
+            try:
+                await asyncio.sleep(0.2 if preference is None else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(preference)
+                raise
+            return preference
+
+        async def run():
+            hedger = Hedger(default_delay_ms=10, max_ratio=1.0)
+            result = await hedger.run(call)
+            await asyncio.sleep(0)
+            return hedger, result
+
+        hedger, result = asyncio.run(run())
+        self.assertTrue(result.startswith("hedge-"))
+        self.assertEqual([None], cancelled)
+        self.assertEqual((1, 1), (hedger.hedged, hedger.hedge_wins))
+
+    def test_failed_hedge_waits_for_primary(self):
+        async def call(preference):
+            if preference is not None:
+                raise RuntimeError("hedge failed")
+            await asyncio.sleep(0.03)
+            return "primary"
+
+        hedger = Hedger(default_delay_ms=5, max_ratio=1.0)
+        self.assertEqual("primary", asyncio.run(hedger.run(call)))
+        self.assertEqual(0, hedger.hedge_wins)
+
+    def test_delay_follows_percentile(self):
+        hedger = Hedger(percentile=90, window=100, default_delay_ms=50, min_delay_ms=1)
+        self.assertEqual(0.05, hedger.delay())
+        hedger._latencies.extend(i / 1000 for i in range(1, 101))
+        self.assertEqual(0.09, hedger.delay())
@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+
+from app.exception.customexception import SearchRejectedException
+from app.helper.limiter import ConcurrencyLimiter
+
+
+class ConcurrencyLimiterTestCase(unittest.TestCase):
+
+    def test_limits_concurrency_in_order(self):
+        order = []
+        running = []
+
+        async def call(i):
+            running.append(i)
+            order.append((i, len(running)))
+            await asyncio.sleep(0.01)
+            running.remove(i)
+            return i
+
+        async def run():
+            limiter = ConcurrencyLimiter(limit=2, max_queue=10)
+            results = await asyncio.gather(*(limiter.run(lambda i=i: call(i)) for i in range(5)))
+            return limiter, results
+
+        limiter, results = asyncio.run(run())
+        self.assertEqual(list(range(5)), results)
+        self.assertEqual(list(range(5)), [i for i, _ in order])
+        self.assertLessEqual(max(concurrent for _, concurrent in order), 2)
+        self.assertEqual({"in_flight": 0, "waiting": 0, "admitted": 5, "queued": 3},
+                         {k: limiter.stats()[k] for k in ("in_flight", "waiting", "admitted", "queued")})
+
+    def test_rejects_when_queue_full_or_wait_too_long(self):
+        async def run():
+            limiter = ConcurrencyLimiter(limit=1, max_queue=1, queue_timeout_ms=20, retry_after=2)
+            return limiter, await asyncio.gather(*(limiter.run(lambda: asyncio.sleep(0.1)) for _ in range(3)),
+                                                 return_exceptions=True)
+
+        limiter, results = asyncio.run(run())
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], SearchRejectedException)
+        self.assertEqual(503, results[1].code)
+        self.assertEqual(429, results[2].code)
+        self.assertEqual(2, results[2].retry_after)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        async def run():
+            limiter = ConcurrencyLimiter(limit=1, max_queue=5)
+            first = asyncio.ensure_future(limiter.run(lambda: asyncio.sleep(0.02)))
+            waiting = asyncio.ensure_future(limiter.run(lambda: asyncio.sleep(0.02)))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.gather(first, waiting, return_exceptions=True)
+            return limiter
+
+        limiter = asyncio.run(run())
+        self.assertEqual((0, 0), (limiter.in_flight, limiter.stats()["waiting"]))
+
+    def test_adaptive_limit_follows_latency(self):
+        limiter = ConcurrencyLimiter(limit=20, adaptive=True, min_limit=4, max_limit=40)
+        for _ in range(50):
+            limiter.in_flight = limiter.limit
+            limiter._release(0.01)
+        grown = limiter.limit
+        self.assertGreater(grown, 20)
+        for _ in range(50):
+            limiter.in_flight = limiter.limit
+            limiter._release(0.2)
+        self.assertLess(limiter.limit, grown)
+        self.assertGreaterEqual(limiter.limit, 4)
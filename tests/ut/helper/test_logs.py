@@ -0,0 +1,26 @@
+import json
+import logging
+import logging.handlers
+import unittest
+
+from app import get_logger
+from app.helper import logs
+
+
+class LogsTestCase(unittest.TestCase):
+
+    def test_json_formatter(self):
+        record = logging.LogRecord("app.test", logging.WARNING, __file__, 1, "Search took %d", (17,), None)
+        record.stage = "opensearch"
+        entry = json.loads(logs.JsonFormatter().format(record))
+        self.assertEqual({"level": "WARNING", "logger": "app.test", "message": "Search took 17",
+                          "stage": "opensearch"}, {k: v for k, v in entry.items() if k != "time"})
+
+    def test_configured_once(self):
+        for _ in range(5):
+            logger = get_logger(name="app.search.route")
+        self.assertEqual([], logger.handlers)
+        queue_handlers = [h for h in logging.getLogger("app").handlers if isinstance(h, logging.handlers.QueueHandler)]
+        self.assertEqual(1, len(queue_handlers))
+        logger.info("Written by the queue listener.")
+        logs.flush()
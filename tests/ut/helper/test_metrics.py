@@ -0,0 +1,39 @@
+import unittest
+
+from app.helper import metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", labels=("stage",), buckets=(0.01, 0.1))
+        for value in (0.005, 0.05, 0.5):
+            histogram.observe(value, "a")
+        lines = histogram.lines()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.01"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{stage="a"} 3', lines)
+        self.assertIn("# TYPE test_seconds histogram", metrics.render())
+
+    def test_counter_and_gauge(self):
+        counter = metrics.Counter("test_errors_total", "Test.", labels=("status",))
+        counter.inc("500")
+        counter.inc("500")
+        gauge = metrics.Gauge("test_in_flight", "Test.")
+        with gauge.track():
+            self.assertEqual(1, gauge.value())
+        self.assertEqual(0, gauge.value())
+        self.assertIn('test_errors_total{status="500"} 2', counter.lines())
+
+    def test_request_timings(self):
+        with metrics.request_timings() as timings:
+            metrics.record("build_query", 0.002)
+            metrics.record("build_query", 0.001)
+            with metrics.timed("reshape"):
+                pass
+        metrics.record("reshape", 1.0)
+        self.assertAlmostEqual(0.003, timings.stages["build_query"])
+        self.assertLess(timings.stages["reshape"], 1.0)
+        self.assertTrue(timings.server_timing().startswith("build_query;dur=3.00, reshape;dur="))
+        self.assertIn("total;dur=", timings.server_timing())
@@ -0,0 +1,44 @@
+import json
+import unittest
+
+from app.helper import serializer
+from app.helper.response import JSONResponse
+
+
+class SerializerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = serializer.backend
+
+    def tearDown(self):
+        serializer.configure(self.backend)
+
+    def test_json_backend(self):
+        self.assertEqual("json", serializer.configure("json"))
+        self.assertEqual('{"a": [1, 2.5, "x"]}', serializer.dumps({"a": [1, 2.5, "x"]}))
+        self.assertEqual(b'{"a":"\xc3\xa4"}', serializer.dumps_bytes({"a": "ä"}))
+        self.assertEqual({"a": 1}, serializer.loads('{"a": 1}'))
+
+    @unittest.skipIf(serializer.orjson is None, "orjson is not installed")
+    def test_orjson_backend(self):
+        self.assertEqual("orjson", serializer.configure("auto"))
+        self.assertEqual('{"a":[1,2.5,"x"]}', serializer.dumps({"a": [1, 2.5, "x"]}))
+        self.assertEqual({"a": 1}, serializer.loads(b'{"a": 1}'))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            serializer.configure("pickle")
+
+    def test_opensearch_serializer(self):
+        os_serializer = serializer.OpenSearchSerializer()
+        self.assertEqual('{"size": 0}', os_serializer.dumps('{"size": 0}'))
+        self.assertEqual({"pit_id": ["x"]}, json.loads(os_serializer.dumps({"pit_id": ["x"]})))
+        self.assertEqual({"took": 3}, os_serializer.loads('{"took": 3}'))
+
+    def test_json_response(self):
+        response = JSONResponse(content={"took": 3, "records": []})
+        self.assertEqual({"took": 3, "records": []}, json.loads(response.body))
+
+
+if __name__ == '__main__':
+    unittest.main()
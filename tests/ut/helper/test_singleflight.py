@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+
+from app.helper.singleflight import SingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_collapses_identical_calls(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            single_flight = SingleFlight()
+            results = await asyncio.gather(*(single_flight.do("q", fetch) for _ in range(5)))
+            return single_flight, results
+
+        single_flight, results = asyncio.run(run())
+        self.assertEqual(["result"] * 5, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual({"in_flight": 0, "calls": 1, "collapsed": 4}, single_flight.stats())
+
+    def test_different_keys_run_separately(self):
+        async def fetch():
+            await asyncio.sleep(0)
+            return 1
+
+        async def run():
+            single_flight = SingleFlight()
+            await asyncio.gather(single_flight.do("a", fetch), single_flight.do("b", fetch))
+            await single_flight.do("a", fetch)
+            return single_flight
+
+        self.assertEqual(3, asyncio.run(run()).calls)
+
+    def test_error_is_shared(self):
+        async def fetch():
+            await asyncio.sleep(0)
+            raise ValueError("boom")
+
+        async def run():
+            single_flight = SingleFlight()
+            return await asyncio.gather(single_flight.do("q", fetch), single_flight.do("q", fetch),
+                                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.helper.slowlog import SlowQueryLog
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+
+    def test_logs_over_threshold(self):
+        logger = MagicMock()
+        slow_log = SlowQueryLog(logger=logger, threshold_ms=100)
+        self.assertFalse(slow_log.observe(50, 40, 3, ("location",), "{}"))
+        self.assertTrue(slow_log.observe(150, 140, 3, ("text", "location"), '{"size": 10}'))
+        record = json.loads(logger.warning.call_args[0][1])
+        self.assertEqual({"elapsed_ms": 150, "took": 140, "hits": 3, "shape": ["text", "location"],
+                          "query": '{"size": 10}'}, record)
+        self.assertEqual(1, slow_log.stats()["logged"])
+
+    def test_sampling(self):
+        logger = MagicMock()
+        slow_log = SlowQueryLog(logger=logger, threshold_ms=100, sample_rate=0.5)
+        with patch("app.helper.slowlog.random.random", side_effect=[0.7, 0.2]):
+            self.assertFalse(slow_log.observe(150, 140, 3, (), "{}"))
+            self.assertTrue(slow_log.observe(150, 140, 3, (), "{}"))
+        self.assertEqual({"slow": 2, "logged": 1}, {k: slow_log.stats()[k] for k in ("slow", "logged")})
@@ -0,0 +1,52 @@
+import math
+import random
+import unittest
+
+from app.helper import spatial
+from app.helper.spatial import Route
+
+
+class GeometryTestSuite(unittest.TestCase):
+
+    def test_geo_point(self):
+        self.assertEqual((1.5, 2.5), spatial.geo_point([2.5, 1.5]))
+        self.assertEqual((1.5, 2.5), spatial.geo_point({"lat": 1.5, "lon": 2.5}))
+        self.assertEqual((1.5, 2.5), spatial.geo_point("1.5,2.5"))
+        self.assertIsNone(spatial.geo_point(None))
+
+    def test_simplify(self):
+        points = [(12.0, 77.0), (12.0001, 77.05), (12.0, 77.1), (12.5, 77.1)]
+        self.assertEqual([(12.0, 77.0), (12.0, 77.1), (12.5, 77.1)], spatial.simplify(points, 0.5))
+
+    def test_route_position(self):
+        route = Route([(12.0, 77.0), (12.0, 77.1), (12.1, 77.1)])
+        along, offset = route.position((12.01, 77.05))
+        self.assertAlmostEqual(route.starts[1] / 2, along, places=2)
+        self.assertAlmostEqual(1.11, offset, places=2)
+        along, offset = route.position((12.05, 77.1))
+        self.assertAlmostEqual((route.starts[1] + route.starts[2]) / 2, along, delta=0.1)
+        self.assertAlmostEqual(0.0, offset, places=6)
+
+    def test_corridor_boxes_cover_buffer(self):
+        rnd = random.Random(3)
+        points = [(12.0 + i * 0.01, 77.0 + math.sin(i / 5) * 0.05) for i in range(200)]
+        boxes = spatial.corridor_boxes(points, 1.0, max_boxes=8)
+        self.assertLessEqual(len(boxes), 8)
+        route = Route(points)
+        for _ in range(300):
+            point = (12.0 + rnd.random() * 2, 76.9 + rnd.random() * 0.2)
+            if route.position(point)[1] <= 1.0:
+                self.assertTrue(any(inside(point, box) for box in boxes), point)
+
+
+def inside(point, polygon) -> bool:
+    crossings = 0
+    for (lat_a, lon_a), (lat_b, lon_b) in zip(polygon, polygon[1:] + polygon[:1]):
+        if (lat_a > point[0]) != (lat_b > point[0]):
+            lon = lon_a + (point[0] - lat_a) * (lon_b - lon_a) / (lat_b - lat_a)
+            crossings += point[1] < lon
+    return crossings % 2 == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
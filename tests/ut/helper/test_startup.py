@@ -0,0 +1,14 @@
+import unittest
+
+from app.helper import startup
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_timed_step_is_reported(self):
+        with startup.timed("test_step"):
+            pass
+        startup.record("test_step", 0.002)
+        report = startup.report()
+        self.assertGreaterEqual(report["steps_ms"]["test_step"], 2.0)
+        self.assertGreater(report["since_start_ms"], 0)
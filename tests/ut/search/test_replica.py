@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+import unittest
+from unittest.mock import MagicMock
+
+from app.helper.grid import np
+from app.search.replica import StationReplica
+from app.search.schema import CSSearchRequest, SearchBy
+
+logger = logging.getLogger("test_replica")
+
+STATIONS = {
+    "a": {"station_id": "1", "name": "Isha Misty Green", "postal_code": "560067", "country": "india",
+          "geo_address": [12.9797, 77.7670], "total_charger_data": {"connectors": [{"status": "available"}]}},
+    "b": {"station_id": "2", "name": "Brigade Tech Park", "postal_code": "560066", "country": "india",
+          "geo_address": [12.9800, 77.7672], "total_charger_data": {"connectors": [{"status": "charging"}]}},
+    "c": {"station_id": "3", "name": "Far Away", "postal_code": "560067", "country": "india",
+          "geo_address": [13.5, 78.5]},
+    "d": {"station_id": "4", "name": "No Location", "postal_code": "560067", "country": "india"}
+}
+
+
+def search_response(docs):
+    return {"hits": {"hits": [{"_id": doc_id, "_source": source, "sort": [source["station_id"]]}
+                              for doc_id, source in docs.items()]}}
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ReplicaTestSuite(unittest.TestCase):
+
+    def loaded(self, **kwargs) -> StationReplica:
+        client = MagicMock()
+        client.search.return_value = search_response(STATIONS)
+        station_replica = StationReplica(get_client=lambda: client, logger=logger, **kwargs)
+        asyncio.run(station_replica.load())
+        return station_replica
+
+    def test_can_answer(self):
+        station_replica = self.loaded()
+        location = [12.9797, 77.7670]
+        self.assertTrue(station_replica.can_answer(CSSearchRequest(location=location, search_by=SearchBy())))
+        self.assertFalse(station_replica.can_answer(CSSearchRequest(location=location,
+                                                                    search_by=SearchBy(text="misty"))))
+        self.assertFalse(station_replica.can_answer(CSSearchRequest(location=location, search_by=SearchBy(),
+                                                                    cursor="*")))
+        self.assertFalse(station_replica.can_answer(CSSearchRequest(location=location, search_by=SearchBy(),
+                                                                    fields=["name.*"])))
+
+    def test_not_loaded(self):
+        station_replica = StationReplica(get_client=MagicMock, logger=logger)
+        self.assertFalse(station_replica.can_answer(CSSearchRequest(location=[1.0, 2.0], search_by=SearchBy())))
+
+    def test_search_by_location(self):
+        result = self.loaded().search(CSSearchRequest(location=[12.9797, 77.7670], proximity_in_km=2,
+                                                      search_by=SearchBy()))
+        self.assertEqual(2, result["total"])
+        self.assertEqual(["a", "b"], [record["id"] for record in result["records"]])
+
+    def test_search_by_location_and_terms(self):
+        result = self.loaded().search(CSSearchRequest(location=[12.9797, 77.7670], proximity_in_km=2,
+                                                      search_by=SearchBy(pincode=560067)))
+        self.assertEqual(["a"], [record["id"] for record in result["records"]])
+        result = self.loaded().search(CSSearchRequest(location=[12.9797, 77.7670], proximity_in_km=2,
+                                                      search_by=SearchBy(connector_status="Charging")))
+        self.assertEqual(["b"], [record["id"] for record in result["records"]])
+
+    def test_search_by_terms_only(self):
+        result = self.loaded().search(CSSearchRequest(search_by=SearchBy(pincode="560067"), limit=2,
+                                                      fields=["name", "total_charger_data.connectors"]))
+        self.assertEqual(3, result["total"])
+        self.assertEqual({"name": "Isha Misty Green", "total_charger_data": {"connectors": [{"status": "available"}]}},
+                         result["records"][0]["charge_station"])
+
+    def test_search_nearest(self):
+        result = self.loaded().search(CSSearchRequest(location=[12.9797, 77.7670], proximity_in_km=2, nearest=1,
+                                                      search_by=SearchBy()))
+        self.assertEqual(["a"], [record["id"] for record in result["records"]])
+        self.assertEqual(0.0, result["records"][0]["distance_km"])
+
+    def test_incremental_refresh(self):
+        station_replica = self.loaded(updated_field="station_id")
+        client = MagicMock()
+        client.search.return_value = search_response({"e": {"station_id": "5", "name": "New", "postal_code": "1",
+                                                             "geo_address": [12.9797, 77.7670]}})
+        station_replica.get_client = lambda: client
+        asyncio.run(station_replica.refresh())
+        query = json.loads(client.search.call_args.kwargs["body"])
+        self.assertIn({"range": {"station_id": {"gte": "4"}}}, query["query"]["bool"]["filter"])
+        self.assertEqual(5, station_replica.stats()["stations"])
+        self.assertEqual(1, station_replica.stats()["refreshes"])
+
+
+if __name__ == '__main__':
+    unittest.main()
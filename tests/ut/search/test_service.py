@@ -2,11 +2,19 @@ import asyncio
 import json
 import logging
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
+
+from opensearchpy.exceptions import ConnectionTimeout, RequestError, TransportError
 
 from app import BASE_DIR
+from app.exception.customexception import SearchException
+from app.helper import metrics, serializer
+from app.helper.batcher import MicroBatcher
+from app.helper.breaker import CircuitBreaker
+from app.helper.cache import TTLCache
+from app.helper.singleflight import SingleFlight
 from app.search import service
-from app.search.schema import CSSearchRequest, SearchBy
+from app.search.schema import CSSearchRequest, CSSearchResult, SearchBy, Viewport, RouteCorridor
 from app.search.service import CSSearchService
 
 logger = logging.getLogger("test_service")
@@ -24,7 +32,7 @@ class ServiceTestSuite(unittest.TestCase):
                                                                                                 [12.3355,
                                                                                                  -77.4355]}}]}}}
         self.assertIsNotNone(query)  # add assertion here
-        self.assertEqual(json.dumps(expected), query)
+        self.assertEqual(expected, json.loads(query))
 
     def test_build_query_with_location_and_pincode(self):
         query = service.build_query(CSSearchRequest(offset=0, limit=100, location=[12.3355, -77.4355],
@@ -36,7 +44,7 @@ class ServiceTestSuite(unittest.TestCase):
                                                                          {"distance_type": "arc", "distance": "2km",
                                                                           "geo_address": [12.3355, -77.4355]}}]}}}
         self.assertIsNotNone(query)  # add assertion here
-        self.assertEqual(json.dumps(expected), query)
+        self.assertEqual(expected, json.loads(query))
 
     def test_build_query_with_location_with_pincode_area(self):
         query = service.build_query(CSSearchRequest(offset=0, limit=100, location=[12.3355, -77.4355],
@@ -50,7 +58,52 @@ class ServiceTestSuite(unittest.TestCase):
                                                                                                  -77.4355]}}]}}}
 
         self.assertIsNotNone(query)  # add assertion here
-        self.assertEqual(json.dumps(expected), query)
+        self.assertEqual(expected, json.loads(query))
+
+    def test_build_query_matches_query_builder(self):
+        requests = [CSSearchRequest(search_by=SearchBy(text="Ather", city="Pune", connector_status="AVAILABLE")),
+                    CSSearchRequest(offset=20, limit=10, location=[12.3355, -77.4355], proximity_in_km=5,
+                                    search_by=SearchBy(name="Avol", avg_rating=4.5)),
+                    CSSearchRequest(location=[12.3355, -77.4355], search_by=SearchBy(text='say "hi"'))]
+        for request in requests:
+            self.assertEqual(service.query_builder(request).build(), service.build_query(request))
+
+    def test_query_params_of_location_only_request(self):
+        params = service.query_params(CSSearchRequest(location=[77.59, 12.97], proximity_in_km=5))
+        self.assertEqual({"offset": 0, "limit": 100, "location": [77.59, 12.97], "proximity_in_km": "5km"}, params)
+
+    def test_build_query_reuses_template(self):
+        service.compile_query.cache_clear()
+        service.build_query(CSSearchRequest(location=[12.3355, -77.4355], search_by=SearchBy(pincode="560067")))
+        service.build_query(CSSearchRequest(location=[13.1, 77.2], search_by=SearchBy(pincode="411014")))
+        self.assertEqual(1, service.compile_query.cache_info().currsize)
+
+    @unittest.skipIf(serializer.orjson is None, "orjson is not installed")
+    def test_build_query_with_orjson(self):
+        request = CSSearchRequest(offset=20, limit=10, location=[12.3355, -77.4355], proximity_in_km=5,
+                                  search_by=SearchBy(name='say "hi"', avg_rating=4.5))
+        expected = json.loads(service.build_query(request))
+        backend = serializer.backend
+        service.compile_query.cache_clear()
+        try:
+            serializer.configure("orjson")
+            query = service.build_query(request)
+            self.assertEqual(service.query_builder(request).build(), query)
+        finally:
+            serializer.configure(backend)
+            service.compile_query.cache_clear()
+        self.assertNotIn(", ", query)
+        self.assertEqual(expected, json.loads(query))
+
+    def test_build_query_with_view_and_fields(self):
+        query = json.loads(service.build_query(CSSearchRequest(location=[12.3355, -77.4355], view="pin")))
+        self.assertEqual({"includes": ["station_id", "name", "geo_address", "total_connectors_available"]},
+                         query["_source"])
+        query = json.loads(service.build_query(CSSearchRequest(location=[12.3355, -77.4355], view="pin",
+                                                               fields=["name"])))
+        self.assertEqual({"includes": ["name"]}, query["_source"])
+        query = json.loads(service.build_query(CSSearchRequest(location=[12.3355, -77.4355], view="full")))
+        self.assertNotIn("_source", query)
 
     def test_search(self):
         with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
@@ -88,6 +141,567 @@ class ServiceTestSuite(unittest.TestCase):
         self.assertEqual(1, cs_res.total)
         self.assertEqual(2.828109, cs_res.max_score)
 
+    def test_search_with_async_client(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.search = AsyncMock(return_value=data)
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(offset=0, limit=20, location=[12.234, -77.342])))
+        mock_os_client.search.assert_awaited_once()
+        self.assertEqual(17, cs_res.took)
+        self.assertEqual(7, cs_res.total)
+
+    def test_search_records_stage_timings(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.search = AsyncMock(return_value=data)
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        with metrics.request_timings() as timings:
+            asyncio.run(cs.search(CSSearchRequest(location=[12.234, -77.342])))
+        self.assertEqual(["build_query", "opensearch", "opensearch_took", "network", "reshape"],
+                         list(timings.stages))
+        self.assertEqual(0.017, timings.stages["opensearch_took"])
+        self.assertEqual(0, metrics.OS_IN_FLIGHT.value())
+
+    def test_build_query_with_profile(self):
+        request = CSSearchRequest(location=[12.3355, -77.4355], profile=True)
+        self.assertTrue(json.loads(service.build_query(request))["profile"])
+        self.assertEqual(service.query_builder(request).build(), service.build_query(request))
+        self.assertNotIn("profile", json.loads(service.build_query(CSSearchRequest(location=[12.3355, -77.4355]))))
+
+    def test_search_profile_skips_cache(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        data = {**data, "profile": {"shards": []}}
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = data
+        slow_log = MagicMock()
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, cache=TTLCache(max_size=10),
+                             slow_log=slow_log)
+        request = CSSearchRequest(location=[12.97891, 77.76930], profile=True)
+        asyncio.run(cs.search(request))
+        cs_res = asyncio.run(cs.search(request))
+        self.assertEqual({"shards": []}, cs_res.profile)
+        self.assertEqual(2, mock_os_client.search.call_count)
+        self.assertEqual(2, slow_log.observe.call_count)
+
+    def test_build_query_with_shard_timeout(self):
+        request = CSSearchRequest(location=[12.3355, -77.4355])
+        query = service.build_query(request, timeout="1500ms")
+        self.assertEqual("1500ms", json.loads(query)["timeout"])
+        self.assertEqual(service.query_builder(request, timeout="1500ms").build(), query)
+
+    def test_search_partial_result_not_cached(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        data = {**data, "timed_out": True}
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = data
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, cache=TTLCache(max_size=10),
+                             timeout_ms=1000, shard_timeout_ms=800)
+        request = CSSearchRequest(location=[12.97891, 77.76930])
+        cs_res = asyncio.run(cs.search(request))
+        asyncio.run(cs.search(request))
+        self.assertTrue(cs_res.timed_out and cs_res.partial)
+        self.assertEqual(2, mock_os_client.search.call_count)
+        self.assertEqual(1.0, mock_os_client.search.call_args.kwargs["request_timeout"])
+        self.assertEqual("800ms", json.loads(mock_os_client.search.call_args.kwargs["body"])["timeout"])
+
+    def test_search_deadline(self):
+        async def slow_search(**kwargs):
+            await asyncio.sleep(1)
+
+        mock_os_client = MagicMock()
+        mock_os_client.search = slow_search
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, timeout_ms=20)
+        with self.assertRaises(SearchException) as ctx:
+            asyncio.run(cs.search(CSSearchRequest(location=[12.97891, 77.76930])))
+        self.assertEqual(504, ctx.exception.code)
+
+    def test_search_serves_stale_result_when_open(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.search.side_effect = [data, RuntimeError("OpenSearch down")]
+        breaker = CircuitBreaker(failure_threshold=1, open_seconds=60, is_failure=CSSearchService.is_failure)
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, breaker=breaker,
+                             stale_cache=TTLCache(max_size=10, ttl_seconds=3600))
+        request = CSSearchRequest(location=[12.97891, 77.76930])
+        fresh = asyncio.run(cs.search(request))
+        failed = asyncio.run(cs.search(request))
+        short_circuited = asyncio.run(cs.search(request))
+        self.assertFalse(fresh.stale)
+        self.assertTrue(failed.stale and short_circuited.stale)
+        self.assertEqual(fresh.records, short_circuited.records)
+        self.assertEqual(2, mock_os_client.search.call_count)
+        with self.assertRaises(SearchException) as ctx:
+            asyncio.run(cs.search(CSSearchRequest(location=[13.5, 77.1])))
+        self.assertEqual(503, ctx.exception.code)
+
+    def test_search_cache_hit(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = data
+        cache = TTLCache(max_size=10, ttl_seconds=30)
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, cache=cache)
+        first = asyncio.run(cs.search(CSSearchRequest(location=[12.97891, 77.76930])))
+        # ~10m away, falls in the same geohash cell for a 2km radius.
+        second = asyncio.run(cs.search(CSSearchRequest(location=[12.97895, 77.76935])))
+        self.assertEqual(first, second)
+        self.assertEqual(1, mock_os_client.search.call_count)
+        self.assertEqual(1, cache.hits)
+
+    def test_cache_key_keeps_origin_of_distance_sorted_requests(self):
+        # same geohash cell at the 512 km radius of a grown nearest search, about 16 km apart
+        first, second = [77.50, 12.90], [77.55, 13.00]
+        for update in ({"nearest": 5, "proximity_in_km": 512}, {"cursor": "*"}):
+            self.assertNotEqual(service.cache_key(CSSearchRequest(location=first, **update)),
+                                service.cache_key(CSSearchRequest(location=second, **update)))
+        self.assertEqual(service.cache_key(CSSearchRequest(location=first, proximity_in_km=512)),
+                         service.cache_key(CSSearchRequest(location=second, proximity_in_km=512)))
+
+    def test_cache_key_separates_far_apart_locations(self):
+        # locations are [lon, lat], longitudes beyond 90 must not be read as latitudes
+        for first, second in (([120.0, 30.0], [150.0, 30.0]), ([-100.0, 40.0], [-170.0, 40.0])):
+            self.assertNotEqual(service.cache_key(CSSearchRequest(location=first)),
+                                service.cache_key(CSSearchRequest(location=second)))
+        self.assertEqual(service.cache_key(CSSearchRequest(location=[77.5946, 12.9716])),
+                         service.cache_key(CSSearchRequest(location=[77.5947, 12.9717])))
+
+    def test_cache_key_and_query_normalize_alike(self):
+        padded = CSSearchRequest(search_by=SearchBy(city="Pune "))
+        plain = CSSearchRequest(search_by=SearchBy(city="pune"))
+        self.assertEqual(service.cache_key(padded), service.cache_key(plain))
+        self.assertEqual(service.build_query(padded), service.build_query(plain))
+
+    def test_cache_key_normalizes_search_by(self):
+        key1 = service.cache_key(CSSearchRequest(search_by=SearchBy(city="Pune ")))
+        key2 = service.cache_key(CSSearchRequest(search_by=SearchBy(city="pune")))
+        self.assertEqual(key1, key2)
+
+    def test_msearch(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            by_location = json.load(cs_json)
+        with open(TEST_BASE_DIR + '/cs_by_location_pincode.json', 'r') as cs_json:
+            by_pincode = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.msearch.return_value = {"took": 20, "responses": [
+            by_location, {"error": {"type": "parsing_exception"}, "status": 400}, by_pincode]}
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        requests = [CSSearchRequest(location=[12.234, -77.342]),
+                    CSSearchRequest(location=[12.234, -77.342], search_by=SearchBy(name="Avol")),
+                    CSSearchRequest(search_by=SearchBy(pincode="560066"))]
+        results = asyncio.run(cs.msearch(requests))
+        body = mock_os_client.msearch.call_args.kwargs["body"]
+        self.assertEqual(["{}", service.build_query(requests[0]), "{}", service.build_query(requests[1]),
+                          "{}", service.build_query(requests[2])], body.splitlines())
+        self.assertEqual(3, len(results))
+        self.assertEqual(7, results[0].result.total)
+        self.assertIsNone(results[1].result)
+        self.assertEqual(400, results[1].error.code)
+        self.assertEqual(2, results[2].result.total)
+
+    def test_msearch_serves_cached_items(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = data
+        mock_os_client.msearch.return_value = {"took": 20, "responses": [data]}
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, cache=TTLCache())
+        cached = asyncio.run(cs.search(CSSearchRequest(location=[12.234, -77.342])))
+        results = asyncio.run(cs.msearch([CSSearchRequest(location=[12.234, -77.342]),
+                                          CSSearchRequest(search_by=SearchBy(city="pune"))]))
+        self.assertEqual(cached, results[0].result)
+        self.assertEqual(2, len(mock_os_client.msearch.call_args.kwargs["body"].splitlines()))
+
+    def test_msearch_rejects_pit(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.msearch.return_value = {"took": 20, "responses": [data]}
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, cache=TTLCache())
+        results = asyncio.run(cs.msearch([CSSearchRequest(location=[12.234, -77.342], cursor="*", pit=True),
+                                          CSSearchRequest(location=[12.234, -77.342])]))
+        self.assertEqual(400, results[0].error.code)
+        self.assertIsNotNone(results[1].result)
+        self.assertEqual(2, len(mock_os_client.msearch.call_args.kwargs["body"].splitlines()))
+        mock_os_client.transport.perform_request.assert_not_called()
+
+    def test_search_with_batcher(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.msearch.return_value = {"took": 20, "responses": [
+            data, {"error": {"type": "parsing_exception"}, "status": 400}]}
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs.batcher = MicroBatcher(flush=cs.msearch_queries, window_ms=5)
+
+        async def run():
+            return await asyncio.gather(cs.search(CSSearchRequest(location=[12.234, -77.342])),
+                                        cs.search(CSSearchRequest(search_by=SearchBy(name="Avol"))),
+                                        return_exceptions=True)
+
+        found, failed = asyncio.run(run())
+        mock_os_client.search.assert_not_called()
+        mock_os_client.msearch.assert_called_once()
+        self.assertEqual(7, found.total)
+        self.assertEqual(400, failed.code)
+
+    def test_search_with_singleflight(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+
+        async def slow_search(**kwargs):
+            await asyncio.sleep(0.01)
+            return data
+
+        mock_os_client = MagicMock()
+        mock_os_client.search = AsyncMock(side_effect=slow_search)
+        single_flight = SingleFlight()
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, singleflight=single_flight)
+
+        async def run():
+            return await asyncio.gather(*(cs.search(CSSearchRequest(location=[12.234, -77.342])) for _ in range(3)))
+
+        results = asyncio.run(run())
+        self.assertEqual(1, mock_os_client.search.await_count)
+        self.assertEqual([7, 7, 7], [result.total for result in results])
+        self.assertEqual(2, single_flight.collapsed)
+
+    def test_build_query_with_cursor(self):
+        cursor = service.encode_cursor([0.532, "115"])
+        query = service.build_query(CSSearchRequest(offset=40, limit=20, location=[12.3355, -77.4355], cursor=cursor))
+        expected = {"from": 0, "size": 20, "query": {"bool": {"filter": [
+            {"geo_distance": {"distance_type": "arc", "distance": "2km", "geo_address": [12.3355, -77.4355]}}]}},
+                    "sort": [{"_geo_distance": {"geo_address": [12.3355, -77.4355], "unit": "km",
+                                                "distance_type": "arc", "order": "asc"}},
+                             {"station_id.keyword": {"order": "asc"}}],
+                    "search_after": [0.532, "115"]}
+        self.assertEqual(expected, json.loads(query))
+
+    def test_build_query_with_invalid_cursor(self):
+        with self.assertRaises(SearchException) as ctx:
+            service.build_query(CSSearchRequest(search_by=SearchBy(city="pune"), cursor="not-a-cursor"))
+        self.assertEqual(400, ctx.exception.code)
+
+    def test_search_with_cursor(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        for i, hit in enumerate(data["hits"]["hits"]):
+            hit["sort"] = [0.1 * i, hit["_source"]["station_id"]]
+        data["hits"]["hits"] = data["hits"]["hits"][:3]
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = data
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(limit=3, location=[12.234, -77.342], cursor="*")))
+        self.assertEqual(([0.2, "3"], None), service.decode_cursor(cs_res.next_cursor))
+
+        cs_res = asyncio.run(cs.search(CSSearchRequest(limit=5, location=[12.234, -77.342],
+                                                       cursor=cs_res.next_cursor)))
+        self.assertIsNone(cs_res.next_cursor)
+        self.assertEqual([0.2, "3"], json.loads(mock_os_client.search.call_args.kwargs["body"])["search_after"])
+
+    def test_search_with_pit(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        for hit in data["hits"]["hits"]:
+            hit["sort"] = [1.0, hit["_source"]["station_id"]]
+        data["pit_id"] = "pit-1"
+        mock_os_client = MagicMock()
+        mock_os_client.transport.perform_request.return_value = {"pit_id": "pit-1"}
+        mock_os_client.search.return_value = data
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(limit=7, search_by=SearchBy(city="bangalore"), cursor="*",
+                                                       pit=True)))
+        call = mock_os_client.search.call_args.kwargs
+        self.assertIsNone(call["index"])
+        self.assertEqual({"id": "pit-1", "keep_alive": "1m"}, json.loads(call["body"])["pit"])
+        self.assertEqual(([1.0, "5"], "pit-1"), service.decode_cursor(cs_res.next_cursor))
+
+    def test_stream(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        hits = data["hits"]["hits"]
+        for i, hit in enumerate(hits):
+            hit["sort"] = [0.1 * i, hit["_source"]["station_id"]]
+        pages = [dict(data, hits=dict(data["hits"], hits=hits[i:i + 3])) for i in range(0, len(hits), 3)]
+        mock_os_client = MagicMock()
+        mock_os_client.search.side_effect = pages
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+
+        async def collect():
+            return [chunk async for chunk in cs.stream(CSSearchRequest(limit=1000, location=[12.234, -77.342]),
+                                                       chunk_size=3)]
+
+        chunks = asyncio.run(collect())
+        self.assertEqual([3, 3, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual("OepYB4MBZrhZq16vNFmF", chunks[0][0]["id"])
+        self.assertEqual(3, mock_os_client.search.call_count)
+        last_body = json.loads(mock_os_client.search.call_args.kwargs["body"])
+        self.assertEqual(hits[5]["sort"], last_body["search_after"])
+        self.assertEqual(3, last_body["size"])
+
+    def test_stream_pages_go_through_breaker(self):
+        mock_os_client = MagicMock()
+        mock_os_client.search.side_effect = TransportError(500, "internal", {})
+        breaker = CircuitBreaker(failure_threshold=1, open_seconds=60, is_failure=CSSearchService.is_failure)
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, breaker=breaker)
+
+        async def collect():
+            return [chunk async for chunk in cs.stream(CSSearchRequest(limit=10, location=[12.234, -77.342]))]
+
+        with self.assertRaises(SearchException) as context:
+            asyncio.run(collect())
+        self.assertEqual(500, context.exception.code)
+        self.assertEqual("open", breaker.stats()["state"])
+        with self.assertRaises(SearchException) as context:
+            asyncio.run(collect())
+        self.assertEqual(503, context.exception.code)
+        self.assertEqual(1, mock_os_client.search.call_count)
+
+    def test_search_passthrough(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = data
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        request = CSSearchRequest(offset=0, limit=20, location=[12.234, -77.342])
+        raw = asyncio.run(cs.search(request, passthrough=True))
+        self.assertIsInstance(raw, dict)
+        self.assertIs(data["hits"]["hits"][0]["_source"], raw["records"][0]["charge_station"])
+        self.assertEqual(asyncio.run(cs.search(request)), CSSearchResult(**raw))
+
+    def test_build_query_with_nearest(self):
+        query = json.loads(service.build_query(CSSearchRequest(offset=40, limit=100, location=[12.3355, -77.4355],
+                                                               nearest=5)))
+        self.assertEqual(0, query["from"])
+        self.assertEqual(5, query["size"])
+        self.assertEqual([{"_geo_distance": {"geo_address": [12.3355, -77.4355], "unit": "km",
+                                             "distance_type": "arc", "order": "asc"}},
+                          {"station_id.keyword": {"order": "asc"}}], query["sort"])
+
+    def test_nearest_radii(self):
+        self.assertEqual([2, 8, 32, 128, 512], service.nearest_radii(2))
+        self.assertEqual([300, 512], service.nearest_radii(300))
+
+    def test_search_nearest_grows_radius(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        for i, hit in enumerate(data["hits"]["hits"]):
+            hit["sort"] = [0.5 * i, hit["_source"]["station_id"]]
+        sparse = {**data, "hits": {**data["hits"], "hits": data["hits"]["hits"][:1]}}
+        mock_os_client = MagicMock()
+        mock_os_client.search.side_effect = [sparse, sparse, data]
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(location=[12.234, -77.342], nearest=3)))
+        distances = [json.loads(call.kwargs["body"])["query"]["bool"]["filter"][0]["geo_distance"]["distance"]
+                     for call in mock_os_client.search.call_args_list]
+        self.assertEqual(["2km", "8km", "32km"], distances)
+        self.assertEqual([0.0, 0.5, 1.0], [record.distance_km for record in cs_res.records[:3]])
+
+    def test_search_nearest_requires_location(self):
+        cs = CSSearchService(os_client=MagicMock(), logger=logger)
+        with self.assertRaises(SearchException) as context:
+            asyncio.run(cs.search(CSSearchRequest(nearest=3)))
+        self.assertEqual(400, context.exception.code)
+
+    def test_search_nearest_rejects_invalid_bounds(self):
+        cs = CSSearchService(os_client=MagicMock(), logger=logger)
+        for request in (CSSearchRequest(location=[12.234, -77.342], nearest=5, proximity_in_km=-1),
+                        CSSearchRequest(location=[12.234, -77.342], nearest=5, proximity_in_km=0),
+                        CSSearchRequest(location=[12.234, -77.342], nearest=0),
+                        CSSearchRequest(location=[12.234, -77.342], nearest=10001)):
+            with self.assertRaises(SearchException) as context:
+                asyncio.run(cs.search(request))
+            self.assertEqual(400, context.exception.code)
+
+    def test_location_requires_proximity(self):
+        mock_os_client = MagicMock()
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, cache=TTLCache(max_size=10))
+        for request in (CSSearchRequest(location=[12.234, -77.342], proximity_in_km=None),
+                        CSSearchRequest(location=[12.234, -77.342], nearest=5, proximity_in_km=None)):
+            with self.assertRaises(SearchException) as context:
+                asyncio.run(cs.search(request))
+            self.assertEqual(400, context.exception.code)
+            self.assertEqual(400, asyncio.run(cs.msearch([request]))[0].error.code)
+        mock_os_client.search.assert_not_called()
+        mock_os_client.msearch.assert_not_called()
+
+    def test_msearch_nearest_grows_radius(self):
+        with open(TEST_BASE_DIR + '/cs_by_location.json', 'r') as cs_json:
+            data = json.load(cs_json)
+        for i, hit in enumerate(data["hits"]["hits"]):
+            hit["sort"] = [0.5 * i, hit["_source"]["station_id"]]
+        mock_os_client = MagicMock()
+        mock_os_client.msearch.return_value = {"took": 20, "responses": [
+            {**data, "hits": {**data["hits"], "hits": []}}]}
+        mock_os_client.search.return_value = data
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        results = asyncio.run(cs.msearch([CSSearchRequest(location=[12.234, -77.342], nearest=2),
+                                          CSSearchRequest(nearest=2)]))
+        query = json.loads(mock_os_client.search.call_args.kwargs["body"])
+        self.assertEqual("8km", query["query"]["bool"]["filter"][0]["geo_distance"]["distance"])
+        self.assertEqual(0.5, results[0].result.records[1].distance_km)
+        self.assertEqual(400, results[1].error.code)
+
+    def test_build_query_with_viewport(self):
+        viewport = Viewport(top_left=[12.95, 77.80], bottom_right=[13.05, 77.70], zoom=15)
+        request = CSSearchRequest(viewport=viewport, search_by=SearchBy(pincode="560067"))
+        query = json.loads(service.build_query(request))
+        self.assertEqual({"geo_bounding_box": {"geo_address": {"top_left": [12.95, 77.80],
+                                                               "bottom_right": [13.05, 77.70]}}},
+                         query["query"]["bool"]["filter"][1])
+        self.assertEqual(100, query["size"])
+        self.assertNotIn("aggs", query)
+        self.assertEqual(service.query_builder(request).build(), service.build_query(request))
+
+    def test_build_query_with_clustered_viewport(self):
+        request = CSSearchRequest(viewport=Viewport(top_left=[10.0, 80.0], bottom_right=[15.0, 75.0], zoom=5))
+        query = json.loads(service.build_query(request))
+        self.assertEqual(0, query["size"])
+        self.assertTrue(query["track_total_hits"])
+        self.assertEqual({"clusters": {"geohash_grid": {"field": "geo_address", "precision": 3, "size": 1000},
+                                       "aggs": {"centroid": {"geo_centroid": {"field": "geo_address"}}}}},
+                         query["aggs"])
+        self.assertEqual(service.query_builder(request, precision=3).build(), service.build_query(request))
+
+    def test_search_clustered_viewport(self):
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = {
+            "took": 4, "timed_out": False, "hits": {"total": {"value": 12}, "max_score": None, "hits": []},
+            "aggregations": {"clusters": {"buckets": [
+                {"key": "tdr", "doc_count": 9, "centroid": {"location": {"lat": 77.7, "lon": 12.9}, "count": 9}},
+                {"key": "tdq", "doc_count": 3, "centroid": {"location": {"lat": 76.1, "lon": 11.2}, "count": 3}}]}}}
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(viewport=Viewport(top_left=[10.0, 80.0],
+                                                                         bottom_right=[15.0, 75.0], zoom=4))))
+        self.assertEqual(12, cs_res.total)
+        self.assertEqual([], cs_res.records)
+        self.assertEqual(("tdr", 9, [12.9, 77.7]), (cs_res.clusters[0].geohash, cs_res.clusters[0].count,
+                                                   cs_res.clusters[0].location))
+
+    def test_search_clustered_viewport_with_cursor(self):
+        cs = CSSearchService(os_client=MagicMock(), logger=logger)
+        with self.assertRaises(SearchException) as context:
+            asyncio.run(cs.search(CSSearchRequest(cursor="*", viewport=Viewport(top_left=[10.0, 80.0],
+                                                                                bottom_right=[15.0, 75.0], zoom=4))))
+        self.assertEqual(400, context.exception.code)
+
+    def test_search_with_invalid_viewport(self):
+        cs = CSSearchService(os_client=MagicMock(), logger=logger)
+        for viewport in (Viewport(top_left=[77.8], bottom_right=[77.7, 12.9]),
+                         Viewport(top_left=[77.7, 95.0], bottom_right=[77.8, 12.9]),
+                         Viewport(top_left=[77.7, 12.9], bottom_right=[77.8, 13.0]),
+                         Viewport(top_left=[77.7, 13.0], bottom_right=[77.8, 12.9], zoom=-1)):
+            with self.assertRaises(SearchException) as context:
+                asyncio.run(cs.search(CSSearchRequest(viewport=viewport)))
+            self.assertEqual(400, context.exception.code)
+
+    def test_invalid_requests_do_not_open_breaker(self):
+        mock_os_client = MagicMock()
+        mock_os_client.search.side_effect = RequestError(400, "parsing_exception", {})
+        breaker = CircuitBreaker(failure_threshold=2, open_seconds=60, is_failure=CSSearchService.is_failure)
+        cs = CSSearchService(os_client=mock_os_client, logger=logger, breaker=breaker)
+        for _ in range(3):
+            with self.assertRaises(SearchException) as context:
+                asyncio.run(cs.search(CSSearchRequest(location=[12.234, -77.342])))
+            self.assertEqual(400, context.exception.code)
+        self.assertEqual("closed", breaker.stats()["state"])
+
+    def test_search_error(self):
+        self.assertEqual(400, service.search_error(RequestError(400, "parsing_exception", {})).code)
+        self.assertEqual(503, service.search_error(TransportError(429, "too_many_requests", {})).code)
+        self.assertEqual(500, service.search_error(TransportError(500, "internal", {})).code)
+        self.assertEqual(504, service.search_error(ConnectionTimeout("TIMEOUT", "timed out", None)).code)
+
+    def test_build_query_with_route(self):
+        route = RouteCorridor(points=[[77.0, 12.0], [77.1, 12.0], [77.1, 12.1]], buffer_km=1)
+        request = CSSearchRequest(route=route, view="pin", search_by=SearchBy(pincode="560067"))
+        query = json.loads(service.build_query(request))
+        self.assertEqual((0, 1000), (query["from"], query["size"]))
+        self.assertIn("geo_address", query["_source"]["includes"])
+        should = query["query"]["bool"]["filter"][1]["bool"]["should"]
+        self.assertEqual(2, len(should))
+        self.assertEqual(4, len(should[0]["geo_polygon"]["geo_address"]["points"]))
+        self.assertEqual(service.query_builder(request, source=service.source_fields(request),
+                                               corridor=service.corridor_clauses(request)).build(),
+                         service.build_query(request))
+
+    @staticmethod
+    def route_response(total, *hits):
+        # hits are (station_id, geo_address, distance from the route start), nearest to the start first
+        return {"took": 6, "timed_out": False, "hits": {"total": {"value": total}, "max_score": 0.0, "hits": [
+            {"_id": station_id, "_score": None, "_source": {"station_id": station_id, "geo_address": geo_address},
+             "sort": [start_km]} for station_id, geo_address, start_km in hits]}}
+
+    def test_search_with_route(self):
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = self.route_response(
+            4, ("start", [77.001, 12.0], 0.11), ("boxed", [77.05, 12.0099], 5.45), ("corner", [77.105, 12.0], 11.42),
+            ("end", [77.1, 12.09], 14.71))
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        route = RouteCorridor(points=[[77.0, 12.0], [77.1, 12.0], [77.1, 12.1]], buffer_km=1)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(route=route, limit=2)))
+        # boxed is inside the polygons but 1.1 km from the route
+        self.assertEqual(3, cs_res.total)
+        self.assertFalse(cs_res.partial)
+        self.assertEqual(["start", "corner"], [record.id for record in cs_res.records])
+        self.assertLess(cs_res.records[0].route_km, cs_res.records[1].route_km)
+        self.assertAlmostEqual(0.54, cs_res.records[1].distance_km, delta=0.01)
+        sort = json.loads(mock_os_client.search.call_args.kwargs["body"])["sort"]
+        self.assertEqual([77.0, 12.0], sort[0]["_geo_distance"]["geo_address"])
+
+    def test_search_with_route_beyond_fetched_hits(self):
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = self.route_response(
+            10, ("start", [77.001, 12.0], 0.11), ("middle", [77.05, 12.0], 5.43), ("corner", [77.105, 12.0], 11.42))
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        route = RouteCorridor(points=[[77.0, 12.0], [77.1, 12.0], [77.1, 12.1]], buffer_km=1)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(route=route)))
+        # stations past 10.4 km along the route may be among the ones not fetched, corner is dropped
+        self.assertEqual(["start", "middle"], [record.id for record in cs_res.records])
+        self.assertEqual(10, cs_res.total)
+        self.assertTrue(cs_res.partial)
+
+    def test_search_with_invalid_route(self):
+        cs = CSSearchService(os_client=MagicMock(), logger=logger)
+        for route in (RouteCorridor(points=[]), RouteCorridor(points=[[77.0]]),
+                      RouteCorridor(points=[[77.0, 12.0]], buffer_km=0)):
+            with self.assertRaises(SearchException) as context:
+                asyncio.run(cs.search(CSSearchRequest(route=route)))
+            self.assertEqual(400, context.exception.code)
+
+    def test_build_query_with_aggregations(self):
+        request = CSSearchRequest(location=[12.3355, -77.4355], limit=0,
+                                  aggregations=["city", "charger_point_type", "city"])
+        query = json.loads(service.build_query(request))
+        self.assertEqual(0, query["size"])
+        self.assertTrue(query["track_total_hits"])
+        self.assertEqual({"city": {"terms": {"field": "town.keyword", "size": 20}},
+                          "charger_point_type": {"terms": {"field": "total_charger_data.charger_point_type.keyword",
+                                                           "size": 20}}}, query["aggs"])
+        self.assertEqual(service.query_builder(request).build(), service.build_query(request))
+
+    def test_build_query_without_aggregations_keeps_default_total(self):
+        self.assertNotIn("track_total_hits", json.loads(service.build_query(CSSearchRequest(location=[12.3, -77.4]))))
+
+    def test_search_with_aggregations(self):
+        mock_os_client = MagicMock()
+        mock_os_client.search.return_value = {
+            "took": 3, "timed_out": False, "hits": {"total": {"value": 14}, "max_score": None, "hits": []},
+            "aggregations": {"city": {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": [
+                {"key": "bangalore", "doc_count": 11}, {"key": "mysore", "doc_count": 3}]}}}
+        cs = CSSearchService(os_client=mock_os_client, logger=logger)
+        cs_res = asyncio.run(cs.search(CSSearchRequest(location=[12.234, -77.342], limit=0, aggregations=["city"])))
+        self.assertEqual(14, cs_res.total)
+        self.assertEqual([], cs_res.records)
+        self.assertEqual([("bangalore", 11), ("mysore", 3)],
+                         [(bucket.value, bucket.count) for bucket in cs_res.aggregations["city"]])
+        self.assertIsNone(cs_res.clusters)
+
 
 if __name__ == '__main__':
     """
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import app
+
+
+class AppInitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app._secret_entry = None
+        self.settings = app.app_settings().copy(update={"os_user_password": None, "secret_refresh_seconds": 60})
+
+    def tearDown(self):
+        app._secret_entry = None
+
+    def test_secret_from_settings(self):
+        with patch.object(app, "fetch_secret") as fetch:
+            self.assertEqual(app.app_settings().os_user_password, app.get_secret())
+        fetch.assert_not_called()
+
+    def test_secret_is_cached(self):
+        with patch.object(app, "app_settings", return_value=self.settings), \
+                patch.object(app, "fetch_secret", return_value="s1") as fetch:
+            self.assertEqual("s1", app.get_secret())
+            self.assertEqual("s1", app.get_secret())
+        self.assertEqual(1, fetch.call_count)
+
+    def test_secret_refresh_failure_keeps_cached(self):
+        self.settings.secret_refresh_seconds = 0
+        with patch.object(app, "app_settings", return_value=self.settings):
+            with patch.object(app, "fetch_secret", return_value="s1"):
+                self.assertEqual("s1", app.get_secret())
+            with patch.object(app, "fetch_secret", side_effect=RuntimeError("throttled")):
+                self.assertEqual("s1", app.get_secret())
+            with patch.object(app, "fetch_secret", return_value="s2"):
+                self.assertEqual("s2", app.get_secret())
+
+    def test_secret_refresh_runs_off_loop(self):
+        self.settings.secret_refresh_seconds = 0
+        threads = []
+        fetched = threading.Event()
+
+        def fetch():
+            threads.append(threading.current_thread())
+            fetched.wait(5)
+            return "s2"
+
+        async def refresh():
+            self.assertEqual("s1", app.get_secret())
+            fetched.set()
+            await app._secret_refresh
+            return app.get_secret()
+
+        with patch.object(app, "app_settings", return_value=self.settings):
+            with patch.object(app, "fetch_secret", return_value="s1"):
+                app.get_secret()
+            with patch.object(app, "fetch_secret", side_effect=fetch):
+                self.assertEqual("s2", asyncio.run(refresh()))
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_rotated_client_is_closed(self):
+        clients = {"p1": AsyncMock(), "p2": AsyncMock()}
+
+        async def rotate():
+            with patch.object(app, "get_secret", side_effect=["p1", "p1", "p2"]):
+                first = app.get_os_async_client()
+                self.assertIs(first, app.get_os_async_client())
+                self.assertIs(clients["p2"], app.get_os_async_client())
+            await app.close_os_clients()
+
+        with patch.object(app, "_os_client_entry", None), \
+                patch.object(app, "_build_os_async_client", side_effect=clients.get):
+            asyncio.run(rotate())
+        clients["p1"].close.assert_awaited_once()
+        clients["p2"].close.assert_awaited_once()
+
+    def test_os_client_is_reused(self):
+        self.assertIs(app.get_os_async_client(), app.get_os_async_client())
+
+    def test_search_service_is_reused(self):
+        self.assertIs(app.get_os_search_service(), app.get_os_search_service())
+
+    def test_lambda_service_is_reused(self):
+        service = app.get_lambda_search_service()
+        self.assertIs(service, app.get_lambda_search_service())
+        self.assertIs(app.get_os_async_client(), service.os_client)
@@ -1,8 +1,29 @@
+import asyncio
+import json
 import unittest
-from unittest.mock import MagicMock, Mock
+from unittest.mock import MagicMock, Mock, patch
 
 from app import lambda_func
 from app.search.schema import CSSearchResult
+from app.search.service import CSSearchService
+
+
+class AsyncClient:
+
+    def __init__(self, response=None):
+        self.response = response
+        self.loops = []
+
+    async def search(self, body, index, **params):
+        self.loops.append(asyncio.get_running_loop())
+        return self.response
+
+    async def msearch(self, body, index, **params):
+        self.loops.append(asyncio.get_running_loop())
+        return {"responses": [self.response for line in body.splitlines()[::2]]}
+
+    async def ping(self):
+        return True
 
 
 class LambdaTest(unittest.TestCase):
@@ -16,6 +37,46 @@ class LambdaTest(unittest.TestCase):
         cs_res = lambda_func.process_request({"from": 0, "limit": 20, "location": [12.2525, -77.5266]})
         self.assertIsNotNone(cs_res)
 
+    def test_event_loop_is_kept_between_invocations(self):
+        client = AsyncClient({"took": 3, "hits": {"total": {"value": 0}, "max_score": None, "hits": []}})
+        service = CSSearchService(os_client=client, logger=Mock())
+        with patch.object(lambda_func, "get_lambda_search_service", return_value=service):
+            for _ in range(2):
+                res = json.loads(lambda_func.process_request({"location": [12.2525, 77.5266]}))
+                self.assertEqual(3, res["took"])
+        self.assertEqual(2, len(client.loops))
+        self.assertIs(client.loops[0], client.loops[1])
+
+    def test_warm_up_event(self):
+        service = CSSearchService(os_client=AsyncClient(), logger=Mock())
+        with patch.object(lambda_func, "get_lambda_search_service", return_value=service):
+            res = json.loads(lambda_func.handler({"warmup": True, "connections": 2}, Mock(aws_request_id="1")))
+        self.assertEqual({"warmup": True, "connections": 2}, res)
+
+    def test_batch_event(self):
+        client = AsyncClient({"took": 4, "hits": {"total": {"value": 0}, "max_score": None, "hits": []}})
+        service = CSSearchService(os_client=client, logger=Mock())
+        events = [
+            [{"location": [12.2525, 77.5266]}, {"limit": "x"}, {"location": [12.3, 77.5], "proximity_in_km": 3}],
+            {"requests": [{"location": [12.2525, 77.5266]}, {"location": [95.0, 77.5]}, {"location": [12.3, 77.5]}]},
+            {"Records": [{"body": json.dumps({"location": [12.2525, 77.5266]})}, {"body": "{"},
+                         {"body": json.dumps({"location": [12.3, 77.5]})}]}
+        ]
+        with patch.object(lambda_func, "get_lambda_search_service", return_value=service):
+            for event in events:
+                res = json.loads(lambda_func.handler(event, Mock(aws_request_id="1")))
+                self.assertEqual(3, len(res))
+                self.assertEqual(4, res[0]["took"])
+                self.assertEqual(400, res[1]["code"])
+                self.assertEqual(4, res[2]["took"])
+        # one multi-search per event
+        self.assertEqual(3, len(client.loops))
+
+    def test_malformed_event(self):
+        for event in (None, 5, "{"):
+            res = json.loads(lambda_func.handler(event, Mock(aws_request_id="1")))
+            self.assertEqual("Internal Server Error", res["message"])
+
 
 if __name__ == '__main__':
     unittest.main()